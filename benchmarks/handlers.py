@@ -0,0 +1,85 @@
+"""
+Микробенчмарк конвейера обработки сообщений: VKBot.handle_event → лимитер → хэндлеры → хранилище.
+
+Без внешних сервисов: хранилище — memory или sqlite (STORAGE_BACKEND), отправка
+сообщений в VK заменена счётчиком. Каждое хранилище замеряется в отдельном
+процессе интерпретатора, потому что STORAGE_BACKEND читается при импорте config.
+
+Запуск: python benchmarks/handlers.py [число_пользователей] [хранилище ...]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PIPELINE_SNIPPET = """
+import json, sys, time
+from utils.vk_api_wrapper import VKBot
+from utils.storage import get_storage
+from handlers import start_handler, payment_handler, access_handler
+
+class OfflineBot(VKBot):
+    def send_message(self, user_id, text):
+        self.sent += 1
+        return {"response": 1}
+
+bot = OfflineBot()
+bot.sent = 0
+for handler in (start_handler.handle, payment_handler.handle, access_handler.handle):
+    bot.register_handler(handler)
+
+def event(user_id, text):
+    return {"type": "message_new", "object": {"message": {"from_id": user_id, "text": text}}}
+
+users = range(1, int(sys.argv[1]) + 1)
+timings = {}
+
+def run(label, text):
+    started = time.perf_counter()
+    for user_id in users:
+        bot.handle_event(event(user_id, text), bot)
+    timings[label] = (time.perf_counter() - started) / len(users)
+
+run("начать", "начать")
+run("купить", "купить")
+run("статус (не оплачено)", "статус")
+run("доступ (не оплачено)", "доступ")
+
+storage = get_storage()
+for user_id in users:
+    storage.set_payment(user_id, f"bench-{user_id}", 499.00)
+    storage.mark_paid(f"bench-{user_id}")
+
+run("статус (оплачено)", "статус")
+run("доступ (оплачено)", "доступ")
+print(json.dumps({"timings": timings, "sent": bot.sent}))
+"""
+
+
+def measure(backend: str, users: int) -> dict:
+    """Прогоняет конвейер в свежем процессе с выбранным хранилищем"""
+    env = dict(os.environ, STORAGE_BACKEND=backend, SQLITE_PATH=":memory:")
+    out = subprocess.run(
+        [sys.executable, "-c", PIPELINE_SNIPPET, str(users)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def report(backend: str, result: dict) -> None:
+    timings = result["timings"]
+    print(f"{backend}: {result['sent']} messages sent")
+    for label, seconds in timings.items():
+        print(f"  {label:<24} {seconds * 1e6:8.1f} µs/event")
+    print(f"  {'median':<24} {statistics.median(timings.values()) * 1e6:8.1f} µs/event")
+
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    backends = sys.argv[2:] or ["memory", "sqlite"]
+    for backend in backends:
+        report(backend, measure(backend, users))
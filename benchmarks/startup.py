@@ -0,0 +1,58 @@
+"""
+Бенчмарк времени старта: холодный импорт main и время до первого обслуженного запроса.
+
+Каждый замер выполняется в отдельном процессе интерпретатора, чтобы кэши
+модулей не влияли на результат. Первый запрос — подтверждение VK Callback,
+он не требует БД и внешних сервисов.
+
+Запуск: python benchmarks/startup.py [число_повторов]
+"""
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+IMPORT_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+print(time.perf_counter() - t0)
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+client = main.app.test_client()
+response = client.post("/vk_callback", json={"type": "confirmation"})
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - t0)
+"""
+
+
+def measure(snippet: str, runs: int) -> list:
+    """Запускает фрагмент в свежих процессах и возвращает времена в секундах"""
+    env = dict(os.environ)
+    env.setdefault("VK_CONFIRMATION_TOKEN", "benchmark")
+    times = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        )
+        times.append(float(out.stdout.strip().splitlines()[-1]))
+    return times
+
+
+def report(name: str, times: list) -> None:
+    print(f"{name:<22} median {statistics.median(times) * 1000:8.1f} ms   "
+          f"min {min(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    report("cold import", measure(IMPORT_SNIPPET, runs))
+    report("first request", measure(FIRST_REQUEST_SNIPPET, runs))
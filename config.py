@@ -7,47 +7,138 @@ load_dotenv()
 # VK API Configuration
 VK_GROUP_TOKEN = os.getenv("VK_GROUP_TOKEN")
 VK_CONFIRMATION_TOKEN = os.getenv("VK_CONFIRMATION_TOKEN")
+VK_GROUP_ID = int(os.getenv("VK_GROUP_ID", 0))
+VK_API_URL = os.getenv("VK_API_URL", "https://api.vk.com/method/")
+
+# VK Bots Long Poll (альтернатива Callback API: python main.py longpoll)
+LONGPOLL_WAIT = int(os.getenv("LONGPOLL_WAIT", 25))
+LONGPOLL_WORKERS = int(os.getenv("LONGPOLL_WORKERS", 4))
+LONGPOLL_TS_FILE = os.getenv("LONGPOLL_TS_FILE", "longpoll_ts.txt")
 
 # YooKassa Configuration
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 
+# Несколько сообществ в одном процессе (необязательно): JSON-файл со списком сообществ.
+# Если не задан — одно сообщество из переменных VK_* / YOOKASSA_* выше (tenant_id = 0)
+TENANTS_FILE = os.getenv("TENANTS_FILE", "")
+
 # Server Configuration
 BASE_URL = os.getenv("BASE_URL", "https://example.com")
 PRIVATE_GROUP_URL = os.getenv("PRIVATE_GROUP_URL", "")
 
+# Хранилище: postgres (продакшен), sqlite или memory (тесты и бенчмарки без внешних сервисов).
+# Очередь уведомлений YooKassa и архивация платежей работают только с postgres
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres").lower()
+SQLITE_PATH = os.getenv("SQLITE_PATH", ":memory:")
+
 # PostgreSQL Configuration
 PG_HOST = os.getenv("PG_HOST", "localhost")
 PG_PORT = int(os.getenv("PG_PORT", 5432))
 PG_USER = os.getenv("PG_USER", "postgres")
 PG_PASSWORD = os.getenv("PG_PASSWORD", "")
 PG_DBNAME = os.getenv("PG_DBNAME", "vk_bot_db")
+PG_CONNECT_TIMEOUT = int(os.getenv("PG_CONNECT_TIMEOUT", 5))
+
+# Пул соединений (общий для всех сообществ процесса)
+PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", 1))
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", 10))
+PG_POOL_TIMEOUT = float(os.getenv("PG_POOL_TIMEOUT", 10))
+# Соединение, простоявшее в пуле дольше, перед выдачей проверяется запросом SELECT 1
+PG_POOL_CHECK_IDLE_SECONDS = float(os.getenv("PG_POOL_CHECK_IDLE_SECONDS", 30))
+# Частые запросы готовятся на сервере один раз на соединение (PREPARE/EXECUTE).
+# Выключите, если между приложением и БД стоит PgBouncer в режиме transaction
+PG_PREPARED_STATEMENTS = os.getenv("PG_PREPARED_STATEMENTS", "true").lower() in ("1", "true", "yes")
+
+# Реплики для чтения (необязательно): "host1:5432,host2:5432", учётные данные как у основной БД
+PG_REPLICA_HOSTS = [h.strip() for h in os.getenv("PG_REPLICA_HOSTS", "").split(",") if h.strip()]
+PG_REPLICA_MAX_LAG_SECONDS = float(os.getenv("PG_REPLICA_MAX_LAG_SECONDS", 5))
+PG_REPLICA_RETRY_SECONDS = float(os.getenv("PG_REPLICA_RETRY_SECONDS", 30))
+PG_READ_YOUR_WRITES_SECONDS = float(os.getenv("PG_READ_YOUR_WRITES_SECONDS", 30))
+# Сколько после создания платёж может быть оплачен: пока он не старше, неоплаченного
+# пользователя с этим платежом, прочитанного с реплики, перепроверяем на основной БД
+PG_PAYMENT_RECHECK_SECONDS = float(os.getenv("PG_PAYMENT_RECHECK_SECONDS", 3600))
 
 # Flask Configuration
 FLASK_HOST = os.getenv("FLASK_HOST", "0.0.0.0")
 FLASK_PORT = int(os.getenv("FLASK_PORT", 5000))
 
+# Хранение платежей: брошенные/отменённые/неуспешные платежи старше
+# RETENTION_ARCHIVE_AFTER_HOURS переносятся в payments_archive пачками
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() in ("1", "true", "yes")
+RETENTION_ARCHIVE_AFTER_HOURS = float(os.getenv("RETENTION_ARCHIVE_AFTER_HOURS", 72))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", 500))
+RETENTION_MAX_BATCHES = int(os.getenv("RETENTION_MAX_BATCHES", 20))
+RETENTION_FLUSH_SECONDS = float(os.getenv("RETENTION_FLUSH_SECONDS", 5))
+RETENTION_ARCHIVE_SECONDS = float(os.getenv("RETENTION_ARCHIVE_SECONDS", 600))
+
+# Очередь уведомлений YooKassa: webhook сохраняет уведомление и сразу отвечает 200,
+# обработку выполняют WEBHOOK_WORKERS потоков в каждом процессе
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 2))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 50))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", 1))
+WEBHOOK_LEASE_SECONDS = float(os.getenv("WEBHOOK_LEASE_SECONDS", 120))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 10))
+WEBHOOK_MAX_RETRY_DELAY = float(os.getenv("WEBHOOK_MAX_RETRY_DELAY", 300))
+WEBHOOK_KEEP_HOURS = float(os.getenv("WEBHOOK_KEEP_HOURS", 72))
+
+# Logging (LOG_SAMPLING: доля сохраняемых записей для частых INFO-событий,
+# например "vk_callback_received:0.01,message_sent:0.1"; ошибки не сэмплируются)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+# Rate limiting (лимит входящих сообщений на пользователя, формат "N/секунд")
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_USERS = int(os.getenv("RATE_LIMIT_MAX_USERS", 100000))
+RATE_LIMITS = {
+    "payment": os.getenv("RATE_LIMIT_PAYMENT", "3/60"),
+    "query": os.getenv("RATE_LIMIT_QUERY", "10/60"),
+    "default": os.getenv("RATE_LIMIT_DEFAULT", "20/60"),
+}
+
+# Circuit breaker для VK и YooKassa (окно — число последних вызовов)
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", 50))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", 10))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", 0.5))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", 5))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", 1))
+
+# Границы адаптивных таймаутов (секунды)
+VK_TIMEOUT_MIN = float(os.getenv("VK_TIMEOUT_MIN", 1))
+VK_TIMEOUT_MAX = float(os.getenv("VK_TIMEOUT_MAX", 10))
+YOOKASSA_TIMEOUT_MIN = float(os.getenv("YOOKASSA_TIMEOUT_MIN", 2))
+YOOKASSA_TIMEOUT_MAX = float(os.getenv("YOOKASSA_TIMEOUT_MAX", 30))
+
+# Диагностика (/admin/*, заголовок X-Admin-Secret). Без ADMIN_SECRET эндпоинты отключены
+ADMIN_SECRET = os.getenv("ADMIN_SECRET", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 20))
+
 # Validation
 def validate_config():
     """Проверяет, что все необходимые переменные установлены"""
     required_vars = [
-        ("VK_GROUP_TOKEN", VK_GROUP_TOKEN),
-        ("VK_CONFIRMATION_TOKEN", VK_CONFIRMATION_TOKEN),
-        ("YOOKASSA_SHOP_ID", YOOKASSA_SHOP_ID),
-        ("YOOKASSA_SECRET_KEY", YOOKASSA_SECRET_KEY),
         ("BASE_URL", BASE_URL),
-        ("PG_USER", PG_USER),
-        ("PG_PASSWORD", PG_PASSWORD),
     ]
+    if STORAGE_BACKEND == "postgres":
+        required_vars += [
+            ("PG_USER", PG_USER),
+            ("PG_PASSWORD", PG_PASSWORD),
+        ]
+    # Токены сообществ задаются в TENANTS_FILE, если он указан
+    if not TENANTS_FILE:
+        required_vars += [
+            ("VK_GROUP_TOKEN", VK_GROUP_TOKEN),
+            ("VK_CONFIRMATION_TOKEN", VK_CONFIRMATION_TOKEN),
+            ("YOOKASSA_SHOP_ID", YOOKASSA_SHOP_ID),
+            ("YOOKASSA_SECRET_KEY", YOOKASSA_SECRET_KEY),
+        ]
     
     missing = [name for name, value in required_vars if not value]
     
     if missing:
         raise ValueError(f"Missing required environment variables: {', '.join(missing)}")
-
-# Запускаем валидацию при импорте
-try:
-    validate_config()
-except ValueError as e:
-    print(f"⚠️  Warning: {e}")
-    print("   Please set environment variables in .env file")
@@ -0,0 +1,19 @@
+# Конфигурация gunicorn: gunicorn -c gunicorn.conf.py main:app
+import os
+
+# Импорт config загружает .env — после него os.getenv видит и переменные оттуда
+from config import FLASK_HOST, FLASK_PORT
+
+bind = f"{FLASK_HOST}:{FLASK_PORT}"
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+# Приложение импортируется один раз в мастер-процессе,
+# воркеры получают уже готовое состояние через fork
+preload_app = True
+
+
+def when_ready(server):
+    """Прогрев общего состояния в мастер-процессе, до запуска воркеров"""
+    from main import warmup
+    warmup()
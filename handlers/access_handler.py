@@ -1,19 +1,11 @@
 from typing import Dict
-from utils.db import is_user_paid, get_user_token
+from utils.storage import get_storage
 from config import BASE_URL
-import json
-from pathlib import Path
+from utils.messages import get_messages
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Загружаем сообщения
-try:
-    MESSAGES = json.load(open(Path(__file__).parent.parent / "static" / "messages.json", encoding="utf-8"))
-except Exception as e:
-    logger.error(f"Error loading messages: {e}")
-    MESSAGES = {}
-
 
 def handle(event: Dict, vkbot) -> None:
     """
@@ -28,27 +20,27 @@ def handle(event: Dict, vkbot) -> None:
 
     try:
         if text == "доступ":
-            if is_user_paid(from_id):
-                token = get_user_token(from_id)
+            if get_storage().is_user_paid(from_id, tenant_id=vkbot.tenant_id):
+                token = get_storage().get_user_token(from_id, tenant_id=vkbot.tenant_id)
                 if token:
                     # Генерируем уникальную ссылку с токеном
                     access_url = f"{BASE_URL}/access?token={token}"
                     # Оборачиваем в VK away.php для безопасности
                     vk_away_url = f"https://vk.com/away.php?to={access_url}"
                     
-                    access_msg = MESSAGES.get("access_granted", 
+                    access_msg = get_messages().get("access_granted", 
                         "✅ Ваша личная ссылка:\n{url}").format(url=vk_away_url)
                     vkbot.send_message(from_id, access_msg)
-                    logger.info(f"Access link sent to user {from_id}")
+                    logger.info("Access link sent to user %s", from_id, extra={"event": "access_link_sent"})
                 else:
-                    vkbot.send_message(from_id, MESSAGES.get("no_token", 
+                    vkbot.send_message(from_id, get_messages().get("no_token", 
                         "❌ Токен доступа не найден. Повторите попытку позже."))
-                    logger.warning(f"No token found for paid user {from_id}")
+                    logger.warning("No token found for paid user %s", from_id)
             else:
-                vkbot.send_message(from_id, MESSAGES.get("no_access", 
+                vkbot.send_message(from_id, get_messages().get("no_access", 
                     "❌ У вас нет доступа. Для получения доступа напишите 'купить'."))
-                logger.info(f"User {from_id} requested access without payment")
+                logger.info("User %s requested access without payment", from_id, extra={"event": "access_denied"})
                 
     except Exception as e:
-        logger.error(f"Error in access_handler for user {from_id}: {e}")
+        logger.error("Error in access_handler for user %s: %s", from_id, e)
         vkbot.send_message(from_id, "❌ Произошла ошибка. Попробуйте позже.")
@@ -1,19 +1,11 @@
 from typing import Dict
 from utils.yookassa_api import create_payment_for_user
-from utils.db import save_user, is_user_paid
-import json
-from pathlib import Path
+from utils.storage import get_storage
+from utils.messages import get_messages
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Загружаем сообщения
-try:
-    MESSAGES = json.load(open(Path(__file__).parent.parent / "static" / "messages.json", encoding="utf-8"))
-except Exception as e:
-    logger.error(f"Error loading messages: {e}")
-    MESSAGES = {}
-
 
 def handle(event: Dict, vkbot) -> None:
     """
@@ -31,34 +23,34 @@ def handle(event: Dict, vkbot) -> None:
     try:
         # Если текст похож на email
         if "@" in text and "." in text:
-            save_user(from_id, contact=text)
-            logger.info(f"Email received from user {from_id}: {text}")
+            get_storage().save_user(from_id, contact=text, tenant_id=vkbot.tenant_id)
+            logger.info("Email received from user %s: %s", from_id, text, extra={"event": "email_received"})
             
             try:
                 # Создаём платёж (фиксированная сумма)
-                res = create_payment_for_user(from_id, 499.00)
-                payment_link = MESSAGES.get("payment_text", "Оплатите по ссылке: {url}").format(url=res["url"])
+                res = create_payment_for_user(from_id, 499.00, tenant_id=vkbot.tenant_id)
+                payment_link = get_messages().get("payment_text", "Оплатите по ссылке: {url}").format(url=res["url"])
                 vkbot.send_message(from_id, payment_link)
-                logger.info(f"Payment link sent to user {from_id}")
+                logger.info("Payment link sent to user %s", from_id, extra={"event": "payment_link_sent"})
                 
             except Exception as e:
-                logger.error(f"Error creating payment for user {from_id}: {e}")
-                vkbot.send_message(from_id, MESSAGES.get("payment_error", 
+                logger.error("Error creating payment for user %s: %s", from_id, e)
+                vkbot.send_message(from_id, get_messages().get("payment_error", 
                     "❌ Ошибка при создании платежа. Попробуйте позже."))
             return
 
         # Если написал 'статус' — проверяем
         if text.lower() == "статус":
-            paid = is_user_paid(from_id)
+            paid = get_storage().is_user_paid(from_id, tenant_id=vkbot.tenant_id)
             if paid:
-                vkbot.send_message(from_id, MESSAGES.get("already_paid", 
+                vkbot.send_message(from_id, get_messages().get("already_paid", 
                     "✅ У вас уже есть доступ!"))
-                logger.info(f"User {from_id} checked status: paid")
+                logger.info("User %s checked status: paid", from_id, extra={"event": "status_checked"})
             else:
-                vkbot.send_message(from_id, MESSAGES.get("not_paid", 
+                vkbot.send_message(from_id, get_messages().get("not_paid", 
                     "❌ Оплата не найдена. Напишите 'купить'."))
-                logger.info(f"User {from_id} checked status: not paid")
+                logger.info("User %s checked status: not paid", from_id, extra={"event": "status_checked"})
                 
     except Exception as e:
-        logger.error(f"Error in payment_handler for user {from_id}: {e}")
+        logger.error("Error in payment_handler for user %s: %s", from_id, e)
         vkbot.send_message(from_id, "❌ Произошла ошибка. Попробуйте позже.")
@@ -1,18 +1,10 @@
-import json
 from typing import Dict
-from utils.db import save_user
-from pathlib import Path
+from utils.storage import get_storage
+from utils.messages import get_messages
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Загружаем сообщения
-try:
-    MESSAGES = json.load(open(Path(__file__).parent.parent / "static" / "messages.json", encoding="utf-8"))
-except Exception as e:
-    logger.error(f"Error loading messages: {e}")
-    MESSAGES = {}
-
 
 def handle(event: Dict, vkbot) -> None:
     """
@@ -29,17 +21,17 @@ def handle(event: Dict, vkbot) -> None:
     try:
         # Простая логика: если написал 'начать' или 'привет' — приветствие
         if text in ("начать", "привет", "/start"):
-            vkbot.send_message(from_id, MESSAGES.get("welcome", "Привет!"))
-            save_user(from_id)
-            logger.info(f"Welcome message sent to user {from_id}")
+            vkbot.send_message(from_id, get_messages().get("welcome", "Привет!"))
+            get_storage().save_user(from_id, tenant_id=vkbot.tenant_id)
+            logger.info("Welcome message sent to user %s", from_id, extra={"event": "welcome_sent"})
             return
 
         # если написал 'купить' — переключаемся на обработчик оплаты
         if text == "купить":
-            vkbot.send_message(from_id, MESSAGES.get("ask_contact", "Пришлите ваш email"))
-            save_user(from_id)
-            logger.info(f"Purchase request from user {from_id}")
+            vkbot.send_message(from_id, get_messages().get("ask_contact", "Пришлите ваш email"))
+            get_storage().save_user(from_id, tenant_id=vkbot.tenant_id)
+            logger.info("Purchase request from user %s", from_id, extra={"event": "purchase_requested"})
             
     except Exception as e:
-        logger.error(f"Error in start_handler for user {from_id}: {e}")
+        logger.error("Error in start_handler for user %s: %s", from_id, e)
         vkbot.send_message(from_id, "❌ Произошла ошибка. Попробуйте позже.")
@@ -1,38 +1,141 @@
-from flask import Flask, request, jsonify
-from utils.db import init_db, verify_access_token
+from flask import Flask, Blueprint, current_app, request, jsonify, g, abort
+from utils.db import close_pools, statement_stats
+from utils.storage import get_storage
 from utils.vk_api_wrapper import VKBot
+from utils.tenants import DEFAULT_TENANT_ID, load_tenants, get_tenant
+from utils.messages import get_messages
+from utils.retention import start_retention_worker
+from utils.webhook_inbox import accept_webhook, start_webhook_workers
 from handlers import start_handler, payment_handler, access_handler
-from config import FLASK_HOST, FLASK_PORT, VK_CONFIRMATION_TOKEN, PRIVATE_GROUP_URL
+from utils.logging_setup import setup_logging, request_id_var, event_id_var
+from utils.profiling import start_request_profile, sample_stacks, get_report, profiling_status
+from config import FLASK_HOST, FLASK_PORT, PRIVATE_GROUP_URL, LONGPOLL_TS_FILE, validate_config
+from config import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_SAMPLING, LOG_QUEUE_SIZE
+from config import ADMIN_SECRET, STORAGE_BACKEND, PG_PREPARED_STATEMENTS
+import hmac
+import sys
+import threading
+import uuid
 import logging
 
-# Логирование
-logging.basicConfig(level=logging.INFO)
+# Логирование (асинхронное: запись в stderr идёт в фоновом потоке)
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_SAMPLING, LOG_QUEUE_SIZE)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+bot = Blueprint("bot", __name__)
 
-# Инициализация базы
-try:
-    init_db()
-    logger.info("Database initialized successfully")
-except Exception as e:
-    logger.error(f"Database initialization failed: {e}")
+_warmup_lock = threading.Lock()
+_warmed_up = False
 
-# Инициализация обёртки VK
-vkbot = VKBot()
 
-# Регистрация хэндлеров (логика обработки message_new)
-vkbot.register_handler(start_handler.handle)
-vkbot.register_handler(payment_handler.handle)
-vkbot.register_handler(access_handler.handle)
+def warmup() -> None:
+    """
+    Однократная инициализация общего состояния: проверка конфигурации, схема БД,
+    список сообществ и каталог сообщений. Вызывается в мастер-процессе gunicorn
+    до fork (preload_app) или перед app.run(). Если её не вызвать, всё то же
+    самое выполнится лениво при первом обращении.
+    """
+    global _warmed_up
+    with _warmup_lock:
+        if _warmed_up:
+            return
+
+        try:
+            validate_config()
+        except ValueError as e:
+            logger.warning("%s. Please set environment variables in .env file", e)
+
+        load_tenants()
+        get_messages()
+
+        try:
+            get_storage().init()
+        except Exception as e:
+            # Не падаем: схема будет создана при первом успешном подключении
+            logger.error("Database initialization failed: %s", e)
+        # Соединения мастера воркерам не достаются — каждый воркер откроет свой пул
+        close_pools()
+
+        _warmed_up = True
+
+
+def create_app() -> Flask:
+    """
+    Фабрика приложения. Не обращается к БД и внешним сервисам —
+    только собирает Flask-приложение и обёртки VK (по одной на сообщество) с хэндлерами.
+    """
+    app = Flask(__name__)
+
+    app.extensions["vkbots"] = {
+        tenant.tenant_id: build_vkbot(tenant) for tenant in load_tenants().values()
+    }
+    app.register_blueprint(bot)
+    return app
+
+
+def build_vkbot(tenant) -> VKBot:
+    """Обёртка VK для сообщества: свой токен и лимитер, общие хэндлеры"""
+    vkbot = VKBot(token=tenant.vk_group_token, group_id=tenant.group_id, tenant_id=tenant.tenant_id)
+
+    # Регистрация хэндлеров (логика обработки message_new)
+    vkbot.register_handler(start_handler.handle)
+    vkbot.register_handler(payment_handler.handle)
+    vkbot.register_handler(access_handler.handle)
+    return vkbot
+
 
+@bot.before_app_request
+def bind_request_id():
+    """Присваивает запросу идентификатор для логов (или берёт X-Request-Id)"""
+    request_id_var.set(request.headers.get("X-Request-Id") or uuid.uuid4().hex[:16])
+    event_id_var.set(None)
 
-@app.route("/vk_callback", methods=["POST"])
+
+@bot.before_app_request
+def ensure_background_workers():
+    """Фоновые потоки не переживают fork, поэтому запускаются в воркере при первом запросе"""
+    start_retention_worker()
+    if STORAGE_BACKEND == "postgres":
+        start_webhook_workers(current_app.extensions["vkbots"])
+
+
+def is_admin() -> bool:
+    """Запрос содержит верный X-Admin-Secret (без ADMIN_SECRET — никогда)"""
+    supplied = request.headers.get("X-Admin-Secret", "")
+    return bool(ADMIN_SECRET) and hmac.compare_digest(supplied.encode(), ADMIN_SECRET.encode())
+
+
+@bot.before_app_request
+def start_profiling():
+    """
+    X-Profile: 1 вместе с X-Admin-Secret — профилировать этот запрос (cProfile и
+    интервалы БД/HTTP). Отчёт доступен по /admin/profiles/<X-Profile-Id из ответа>.
+    """
+    if "X-Profile" in request.headers and is_admin():
+        g.profile = start_request_profile(request_id_var.get())
+
+
+@bot.after_app_request
+def add_profile_header(response):
+    if "profile" in g:
+        # busy — уже профилируется другой запрос
+        response.headers["X-Profile-Id"] = g.profile.profile_id if g.profile else "busy"
+    return response
+
+
+@bot.teardown_app_request
+def finish_profiling(exc):
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.stop()
+
+
+@bot.route("/vk_callback", methods=["POST"])
 def vk_callback():
     """
-    Точка входа для VK Callback API.
-    При подключении VK присылает type == 'confirmation' — возвращаем VK_CONFIRMATION_TOKEN.
-    При новых сообщениях — передаём объект в vkbot для обработки.
+    Точка входа для VK Callback API (общая для всех сообществ, различаются по group_id).
+    При подключении VK присылает type == 'confirmation' — возвращаем код подтверждения сообщества.
+    При новых сообщениях — передаём объект в vkbot этого сообщества.
     """
     try:
         data = request.get_json()
@@ -41,28 +144,37 @@ def vk_callback():
             return "no data", 400
 
         t = data.get("type")
-        logger.info(f"VK callback received: type={t}")
+        event_id_var.set(data.get("event_id"))
+        logger.info("VK callback received: type=%s", t, extra={"event": "vk_callback_received"})
+
+        tenant = get_tenant(data.get("group_id"))
+        if tenant is None:
+            logger.warning("VK callback for unknown group %s", data.get("group_id"))
+            return "unknown group", 404
         
         if t == "confirmation":
-            logger.info("VK confirmation token sent")
-            return VK_CONFIRMATION_TOKEN
+            logger.info("VK confirmation token sent for group %s", tenant.group_id)
+            return tenant.vk_confirmation_token
 
         if t == "message_new":
             # Делегируем обработку с передачей экземпляра vkbot
+            vkbot = current_app.extensions["vkbots"][tenant.tenant_id]
             vkbot.handle_event(data, vkbot)
             return "ok", 200
             
         return "ok", 200
         
     except Exception as e:
-        logger.error(f"VK callback error: {e}", exc_info=True)
+        logger.error("VK callback error: %s", e, exc_info=True)
         return "error", 500
 
 
-@app.route("/yookassa_webhook", methods=["POST"])
+@bot.route("/yookassa_webhook", methods=["POST"])
 def yookassa_webhook():
     """
-    Принимаем webhook от YooKassa.
+    Принимаем webhook от YooKassa: сохраняем уведомление в webhook_inbox и сразу
+    отвечаем 200. Обработка — в фоновых воркерах (utils/webhook_inbox.py).
+    Если сохранить не удалось — 500, YooKassa повторит доставку.
     """
     try:
         payload = request.get_json()
@@ -70,20 +182,39 @@ def yookassa_webhook():
             logger.warning("Empty webhook payload received")
             return "error", 400
 
-        logger.info(f"YooKassa webhook: event={payload.get('event')}")
-        
-        from utils.yookassa_api import process_webhook_event
-        process_webhook_event(payload, vkbot)
-        
-        logger.info("Webhook processed successfully")
+        obj = payload.get("object") or {}
+        event_id_var.set(obj.get("id"))
+        logger.info("YooKassa webhook: event=%s", payload.get('event'))
+
+        # Платежи, созданные до появления мультиарендности, без tenant_id — сообщество по умолчанию
+        raw_tenant_id = (obj.get("metadata") or {}).get("tenant_id", DEFAULT_TENANT_ID)
+        try:
+            tenant_id = int(raw_tenant_id)
+        except (TypeError, ValueError):
+            # Повторная доставка такого уведомления ничего не изменит — 400, а не 500
+            logger.error("Webhook with malformed tenant_id %r", raw_tenant_id)
+            return jsonify({"error": "malformed tenant_id"}), 400
+        if tenant_id not in current_app.extensions["vkbots"]:
+            # 500: YooKassa повторит доставку, когда сообщество появится в конфигурации
+            logger.error("Webhook for unknown tenant %s", tenant_id)
+            return jsonify({"error": "unknown tenant"}), 500
+
+        if STORAGE_BACKEND != "postgres":
+            # Очередь есть только в PostgreSQL — без неё обрабатываем сразу
+            from utils.yookassa_api import process_webhook_event
+            process_webhook_event(payload, current_app.extensions["vkbots"][tenant_id])
+            return jsonify({"status": "ok"}), 200
+
+        inbox_id = accept_webhook(obj.get("id"), tenant_id, payload)
+        logger.info("Webhook queued: %s", inbox_id, extra={"event": "webhook_queued"})
         return jsonify({"status": "ok"}), 200
         
     except Exception as exc:
-        logger.error(f"Webhook processing error: {exc}", exc_info=True)
+        logger.error("Webhook processing error: %s", exc, exc_info=True)
         return jsonify({"error": str(exc)}), 500
 
 
-@app.route("/access", methods=["GET"])
+@bot.route("/access", methods=["GET"])
 def access_link():
     """
     Отправляет HTML страницу для проверки токена.
@@ -93,11 +224,11 @@ def access_link():
         with open('templates/access.html', encoding='utf-8') as f:
             return f.read(), 200, {'Content-Type': 'text/html; charset=utf-8'}
     except Exception as e:
-        logger.error(f"Access page error: {e}")
+        logger.error("Access page error: %s", e)
         return "Error loading page", 500
 
 
-@app.route("/verify-token", methods=["GET"])
+@bot.route("/verify-token", methods=["GET"])
 def verify_token():
     """
     API эндпоинт для проверки токена доступа (AJAX запрос).
@@ -109,55 +240,157 @@ def verify_token():
             logger.warning("Token verification: no token provided")
             return jsonify({"valid": False, "message": "Токен не предоставлен"}), 400
         
-        logger.info(f"Token verification attempt: {token[:8]}...")
-        result = verify_access_token(token)
+        logger.info("Token verification attempt: %s...", token[:8], extra={"event": "token_verification"})
+        result = get_storage().verify_access_token(token)
         
         if result["valid"]:
-            logger.info(f"Token verified successfully for user {result['user_id']}")
+            logger.info("Token verified successfully for user %s", result['user_id'])
             return jsonify(result), 200
         else:
-            logger.warning(f"Token verification failed: {result['message']}")
+            logger.warning("Token verification failed: %s", result['message'])
             return jsonify(result), 403
             
     except Exception as e:
-        logger.error(f"Token verification error: {e}", exc_info=True)
+        logger.error("Token verification error: %s", e, exc_info=True)
         return jsonify({"valid": False, "message": "Ошибка сервера"}), 500
 
 
-@app.route("/health", methods=["GET"])
+@bot.route("/health", methods=["GET"])
 def health_check():
     """
     Health check endpoint для мониторинга.
+    upstreams — состояние предохранителей VK и YooKassa в этом процессе.
     """
     try:
-        from utils.db import get_payment_stats
-        stats = get_payment_stats()
+        from utils.circuit_breaker import breakers_snapshot, any_open
+        stats = get_storage().get_payment_stats()
         return jsonify({
-            "status": "ok",
-            "stats": stats
+            "status": "degraded" if any_open() else "ok",
+            "stats": stats,
+            "upstreams": breakers_snapshot()
         }), 200
     except Exception as e:
-        logger.error(f"Health check error: {e}")
+        logger.error("Health check error: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
-@app.errorhandler(404)
+@bot.route("/admin/profiles", methods=["GET"])
+def admin_profiles():
+    """Состояние профилировщика и id сохранённых отчётов"""
+    if not is_admin():
+        abort(404)
+    return jsonify(profiling_status()), 200
+
+
+@bot.route("/admin/profiles/<profile_id>", methods=["GET"])
+def admin_profile_report(profile_id):
+    """Отчёт профилирования запроса (текст)"""
+    if not is_admin():
+        abort(404)
+    report = get_report(profile_id)
+    if report is None:
+        abort(404)
+    return report, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@bot.route("/admin/profile/sample", methods=["GET"])
+def admin_profile_sample():
+    """
+    Снимает стеки всех потоков процесса в течение seconds секунд (по умолчанию 10)
+    и возвращает их в свёрнутом виде для flamegraph.pl / speedscope.
+    Профилируется только воркер, получивший этот запрос.
+    """
+    if not is_admin():
+        abort(404)
+    try:
+        seconds = float(request.args.get("seconds", 10))
+        interval = max(0.001, float(request.args.get("interval", 0.005)))
+    except ValueError:
+        return jsonify({"error": "seconds and interval must be numbers"}), 400
+
+    stacks = sample_stacks(seconds, interval)
+    if stacks is None:
+        return jsonify({"error": "sampling already running"}), 409
+    return stacks, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+
+@bot.route("/admin/db/statements", methods=["GET"])
+def admin_db_statements():
+    """Статистика подготовленных запросов utils/db.py в этом воркере"""
+    if not is_admin():
+        abort(404)
+    return jsonify({
+        "prepared": PG_PREPARED_STATEMENTS,
+        "statements": statement_stats(),
+    }), 200
+
+
+@bot.app_errorhandler(404)
 def not_found(error):
     """Обработка 404 ошибок"""
     return jsonify({"error": "Not found"}), 404
 
 
-@app.errorhandler(500)
+@bot.app_errorhandler(500)
 def internal_error(error):
     """Обработка 500 ошибок"""
-    logger.error(f"Internal server error: {error}")
+    logger.error("Internal server error: %s", error)
     return jsonify({"error": "Internal server error"}), 500
 
 
+app = create_app()
+
+
+def run_longpoll() -> int:
+    """
+    Получение событий через Bots Long Poll вместо Callback-эндпоинта:
+    по потоку на сообщество, у каждого свой файл ts.
+    Возвращает код выхода: 0 — остановлено по Ctrl+C, 1 — ошибка конфигурации
+    или поток сообщества завершился (супервизор должен перезапустить процесс).
+    """
+    from utils.longpoll import LongPollRunner
+
+    warmup()
+    start_retention_worker()
+    vkbots = app.extensions["vkbots"]
+    runners = []
+    for vkbot in vkbots.values():
+        ts_file = LONGPOLL_TS_FILE
+        if ts_file and len(vkbots) > 1:
+            ts_file = f"{ts_file}.{vkbot.group_id}"
+        try:
+            runners.append(LongPollRunner(vkbot, vkbot.group_id, ts_file=ts_file))
+        except ValueError as exc:
+            logger.error("Long Poll not started for tenant %s: %s", vkbot.tenant_id, exc)
+            return 1
+
+    threads = [threading.Thread(target=runner.run_forever, name=f"longpoll-{runner.group_id}", daemon=True)
+               for runner in runners]
+    for thread in threads:
+        thread.start()
+    try:
+        while all(thread.is_alive() for thread in threads):
+            threads[0].join(1)
+    except KeyboardInterrupt:
+        for runner in runners:
+            runner.stop()
+        return 0
+
+    dead = [thread.name for thread in threads if not thread.is_alive()]
+    logger.error("Long Poll runner(s) stopped unexpectedly: %s", ", ".join(dead))
+    for runner in runners:
+        runner.stop()
+    return 1
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "longpoll":
+        sys.exit(run_longpoll())
+
+    warmup()
     logger.info("=" * 50)
     logger.info("VK Payment Bot starting...")
-    logger.info(f"Host: {FLASK_HOST}, Port: {FLASK_PORT}")
+    logger.info("Host: %s, Port: %s", FLASK_HOST, FLASK_PORT)
     logger.info("=" * 50)
     
     app.run(host=FLASK_HOST, port=FLASK_PORT, debug=False)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Корень проекта — в sys.path, чтобы тесты импортировали config и utils так же, как main.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
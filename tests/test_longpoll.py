@@ -0,0 +1,162 @@
+"""
+LongPollRunner против локального заглушечного сервера: groups.getLongPollServer
+и Long Poll сервер VK отвечают из StubVK, события уходят в фиктивный VKBot.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from utils.longpoll import LongPollRunner
+
+TOKEN = "secret-group-token"
+
+
+class StubVK:
+    """Имитация VK: выдаёт заданные пачки событий по очереди, потом пустые ответы"""
+
+    def __init__(self, batches, server_errors=0):
+        self.batches = list(batches)
+        self.server_errors = server_errors
+        self.server_requests = []
+        self.polled_ts = []
+        self.ts = 100
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                with stub.lock:
+                    stub.server_requests.append({"path": self.path, "form": form})
+                    if stub.server_errors:
+                        stub.server_errors -= 1
+                        self._reply({"error": {"error_code": 10, "error_msg": "Internal server error"}})
+                        return
+                    ts = stub.ts
+                self._reply({"response": {"server": f"{stub.url}lp", "key": "k", "ts": str(ts)}})
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                with stub.lock:
+                    stub.polled_ts.append(query["ts"][0])
+                    updates = stub.batches.pop(0) if stub.batches else []
+                    if updates:
+                        stub.ts += 1
+                    ts = stub.ts
+                if not updates:
+                    time.sleep(0.02)
+                self._reply({"ts": str(ts), "updates": updates})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RecordingBot:
+    token = TOKEN
+
+    def __init__(self):
+        self.events = []
+
+    def handle_event(self, data, vkbot):
+        self.events.append(data["object"]["message"]["text"])
+
+
+def message(from_id, text):
+    return {"type": "message_new", "object": {"message": {"from_id": from_id, "text": text}}}
+
+
+def run_until(runner, condition, timeout=10.0):
+    thread = threading.Thread(target=runner.run_forever, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    runner.stop()
+    thread.join(timeout)
+    assert not thread.is_alive()
+    assert condition()
+
+
+@pytest.fixture
+def stub_factory():
+    stubs = []
+
+    def factory(*args, **kwargs):
+        stubs.append(StubVK(*args, **kwargs))
+        return stubs[-1]
+
+    yield factory
+    for stub in stubs:
+        stub.close()
+
+
+def test_dispatches_events_in_order_per_user(stub_factory, tmp_path):
+    stub = stub_factory([[message(1, "начать"), message(2, "купить"), message(1, "статус")]])
+    bot = RecordingBot()
+    runner = LongPollRunner(bot, 7, wait=0, workers=2, ts_file=str(tmp_path / "ts"), api_url=stub.url)
+
+    run_until(runner, lambda: len(bot.events) == 3)
+    user_1 = [text for text in bot.events if text in ("начать", "статус")]
+    assert user_1 == ["начать", "статус"]
+    assert "купить" in bot.events
+
+
+def test_persists_and_resumes_ts(stub_factory, tmp_path):
+    ts_file = tmp_path / "ts"
+    stub = stub_factory([[message(1, "начать")]])
+    bot = RecordingBot()
+    runner = LongPollRunner(bot, 7, wait=0, ts_file=str(ts_file), api_url=stub.url)
+    run_until(runner, lambda: bot.events and ts_file.exists() and ts_file.read_text() == "101")
+
+    # Новый процесс продолжает с сохранённого ts, а не с ts сервера
+    stub.ts = 500
+    resumed = LongPollRunner(RecordingBot(), 7, wait=0, ts_file=str(ts_file), api_url=stub.url)
+    polled_before = len(stub.polled_ts)
+    run_until(resumed, lambda: len(stub.polled_ts) > polled_before)
+    assert stub.polled_ts[polled_before] == "101"
+
+
+def test_retries_failed_startup(stub_factory, tmp_path):
+    stub = stub_factory([[message(1, "начать")]], server_errors=1)
+    bot = RecordingBot()
+    runner = LongPollRunner(bot, 7, wait=0, ts_file=str(tmp_path / "ts"), api_url=stub.url)
+
+    run_until(runner, lambda: bot.events == ["начать"])
+    assert len(stub.server_requests) >= 2
+
+
+def test_token_is_sent_in_body(stub_factory, tmp_path):
+    stub = stub_factory([])
+    runner = LongPollRunner(RecordingBot(), 7, wait=0, ts_file=str(tmp_path / "ts"), api_url=stub.url)
+    run_until(runner, lambda: stub.polled_ts)
+
+    request = stub.server_requests[0]
+    assert TOKEN not in request["path"]
+    assert request["form"]["access_token"] == [TOKEN]
+    assert request["form"]["group_id"] == ["7"]
+
+
+def test_requires_group_id(tmp_path):
+    with pytest.raises(ValueError):
+        LongPollRunner(RecordingBot(), 0, ts_file=str(tmp_path / "ts"))
@@ -0,0 +1,239 @@
+"""
+Общие сценарии для всех реализаций Storage: MemoryStorage, SQLiteStorage и
+PostgresStorage. PostgreSQL проверяется, только если задан PG_TEST_DSN
+(строка подключения libpq к отдельной тестовой БД, например
+"host=127.0.0.1 dbname=vk_bot_test user=postgres password=...").
+"""
+import os
+import random
+import uuid
+from decimal import Decimal
+
+import psycopg2
+import pytest
+from psycopg2.extensions import parse_dsn
+
+from utils import db
+from utils.storage import PostgresStorage
+from utils.storage_memory import MemoryStorage
+from utils.storage_sqlite import SQLiteStorage
+
+PG_TEST_DSN = os.getenv("PG_TEST_DSN", "")
+
+NOT_FOUND = "Токен не найден или истёк"
+ALREADY_USED = "Токен уже был использован"
+GRANTED = "Доступ разрешён"
+
+
+@pytest.fixture(params=[
+    "memory",
+    "sqlite",
+    pytest.param("postgres", marks=pytest.mark.skipif(not PG_TEST_DSN, reason="PG_TEST_DSN не задан")),
+])
+def storage(request):
+    if request.param == "memory":
+        return MemoryStorage()
+    if request.param == "sqlite":
+        return SQLiteStorage(":memory:")
+    # Пул создаётся при первом обращении и берёт параметры из db.DSN
+    db.DSN.update(parse_dsn(PG_TEST_DSN))
+    postgres = PostgresStorage()
+    postgres.init()
+    return postgres
+
+
+@pytest.fixture
+def tenant():
+    # Тестовая БД PostgreSQL переживает прогоны — каждому тесту своё сообщество
+    return random.randint(10 ** 9, 2 * 10 ** 9)
+
+
+def new_payment_id() -> str:
+    return f"test-{uuid.uuid4().hex}"
+
+
+def paid_user(storage, tenant, user_id=1):
+    """Пользователь с успешным платежом; возвращает его токен"""
+    payment_id = new_payment_id()
+    storage.save_user(user_id, tenant_id=tenant)
+    storage.set_payment(user_id, payment_id, 100, tenant_id=tenant)
+    return storage.mark_paid(payment_id)
+
+
+def test_save_user_updates_only_given_fields(storage, tenant):
+    storage.save_user(1, name="Иван", tenant_id=tenant)
+    assert storage.get_access_info(1, tenant_id=tenant)["contact"] is None
+
+    storage.save_user(1, contact="@ivan", tenant_id=tenant)
+    storage.save_user(1, name="Пётр", tenant_id=tenant)
+    assert storage.get_access_info(1, tenant_id=tenant)["contact"] == "@ivan"
+
+    storage.save_user(1, contact="@petr", tenant_id=tenant)
+    info = storage.get_access_info(1, tenant_id=tenant)
+    assert info["contact"] == "@petr"
+    assert info["is_paid"] is False
+    assert info["has_token"] is False
+
+
+def test_unknown_user(storage, tenant):
+    assert storage.is_user_paid(1, tenant_id=tenant) is False
+    assert storage.get_user_token(1, tenant_id=tenant) is None
+    assert storage.get_access_info(1, tenant_id=tenant) == {"error": "Пользователь не найден"}
+
+
+def test_set_payment_conflict_resets_status_only(storage, tenant):
+    payment_id = new_payment_id()
+    storage.save_user(1, tenant_id=tenant)
+    storage.set_payment(1, payment_id, 10.5, tenant_id=tenant)
+    assert storage.update_payment_statuses([(payment_id, "canceled")]) == 1
+
+    # Повторное создание того же платежа возвращает его в 'created', сумма не меняется
+    storage.set_payment(1, payment_id, 99, tenant_id=tenant)
+    payments = storage.get_payment_stats(tenant_id=tenant)["payments"]
+    assert payments["total_payments"] == 1
+    assert payments["pending"] == 1
+    assert payments["canceled"] == 0
+    assert payments["total_amount"] == Decimal("10.50")
+
+
+def test_mark_paid_missing_payment(storage):
+    assert storage.mark_paid(new_payment_id()) is None
+
+
+def test_mark_paid_grants_access_once(storage, tenant):
+    payment_id = new_payment_id()
+    storage.save_user(1, tenant_id=tenant)
+    storage.set_payment(1, payment_id, 100, tenant_id=tenant)
+    assert storage.is_user_paid(1, tenant_id=tenant) is False
+
+    token = storage.mark_paid(payment_id)
+    assert token
+    assert storage.is_user_paid(1, tenant_id=tenant) is True
+    assert storage.get_user_token(1, tenant_id=tenant) == token
+
+    # Повторное уведомление не выдаёт новый токен и не отменяет отправленную ссылку
+    assert storage.mark_paid(payment_id) is None
+    assert storage.get_user_token(1, tenant_id=tenant) == token
+
+
+def test_mark_paid_replay_returns_unused_token(storage, tenant):
+    payment_id = new_payment_id()
+    storage.save_user(1, tenant_id=tenant)
+    storage.set_payment(1, payment_id, 100, tenant_id=tenant)
+    token = storage.mark_paid(payment_id)
+
+    # Повтор уведомления после падения воркера досылает ту же ссылку
+    assert storage.mark_paid(payment_id, replay=True) == token
+    assert storage.get_user_token(1, tenant_id=tenant) == token
+
+    # Использованную или отозванную ссылку повторно не отправляем
+    storage.verify_access_token(token)
+    assert storage.mark_paid(payment_id, replay=True) is None
+    storage.revoke_access(1, tenant_id=tenant)
+    assert storage.mark_paid(payment_id, replay=True) is None
+
+
+def test_update_payment_statuses_changes_only_created(storage, tenant):
+    created, succeeded = new_payment_id(), new_payment_id()
+    storage.save_user(1, tenant_id=tenant)
+    storage.set_payment(1, created, 100, tenant_id=tenant)
+    storage.set_payment(1, succeeded, 100, tenant_id=tenant)
+    storage.mark_paid(succeeded)
+
+    assert storage.update_payment_statuses([]) == 0
+    assert storage.update_payment_statuses([
+        (created, "canceled"),
+        (succeeded, "failed"),
+        (new_payment_id(), "failed"),
+    ]) == 1
+    assert storage.update_payment_statuses([(created, "failed")]) == 0
+
+    payments = storage.get_payment_stats(tenant_id=tenant)["payments"]
+    assert (payments["succeeded"], payments["canceled"], payments["failed"], payments["pending"]) == (1, 1, 0, 0)
+
+
+def test_verify_access_token_messages(storage, tenant):
+    token = paid_user(storage, tenant)
+
+    assert storage.verify_access_token("no-such-token") == {"valid": False, "message": NOT_FOUND, "user_id": None}
+    assert storage.verify_access_token(token) == {"valid": True, "message": GRANTED, "user_id": 1}
+    assert storage.verify_access_token(token) == {"valid": False, "message": ALREADY_USED, "user_id": 1}
+    assert storage.get_access_info(1, tenant_id=tenant)["token_used"] is True
+
+
+def test_renew_user_token(storage, tenant):
+    storage.save_user(2, tenant_id=tenant)
+    assert storage.renew_user_token(2, tenant_id=tenant) is None
+
+    token = paid_user(storage, tenant)
+    storage.verify_access_token(token)
+    new_token = storage.renew_user_token(1, tenant_id=tenant)
+    assert new_token and new_token != token
+    assert storage.get_user_token(1, tenant_id=tenant) == new_token
+    assert storage.verify_access_token(token)["message"] == NOT_FOUND
+    assert storage.verify_access_token(new_token)["valid"] is True
+
+
+def test_revoke_access(storage, tenant):
+    token = paid_user(storage, tenant)
+    assert storage.revoke_access(1, tenant_id=tenant) is True
+    assert storage.revoke_access(2, tenant_id=tenant) is False
+
+    assert storage.is_user_paid(1, tenant_id=tenant) is False
+    assert storage.get_user_token(1, tenant_id=tenant) is None
+    assert storage.renew_user_token(1, tenant_id=tenant) is None
+    assert storage.verify_access_token(token)["message"] == NOT_FOUND
+
+
+def test_payment_stats_empty(storage, tenant):
+    assert storage.get_payment_stats(tenant_id=tenant) == {
+        "users": {"total_users": 0, "paid_users": None, "accessed_users": None},
+        "payments": {
+            "total_payments": 0, "succeeded": None, "failed": None,
+            "canceled": None, "pending": None, "total_amount": None,
+        },
+    }
+
+
+def test_payment_stats_per_tenant(storage, tenant):
+    other = tenant + 1
+    token = paid_user(storage, tenant, user_id=1)
+    storage.verify_access_token(token)
+    storage.save_user(2, tenant_id=tenant)
+    storage.set_payment(2, new_payment_id(), 0.5, tenant_id=tenant)
+    storage.save_user(1, tenant_id=other)
+    storage.set_payment(1, new_payment_id(), 7, tenant_id=other)
+
+    # Пользователь с тем же user_id в другом сообществе — отдельная запись
+    assert storage.is_user_paid(1, tenant_id=other) is False
+
+    stats = storage.get_payment_stats(tenant_id=tenant)
+    assert stats["users"] == {"total_users": 2, "paid_users": 1, "accessed_users": 1}
+    assert stats["payments"] == {
+        "total_payments": 2, "succeeded": 1, "failed": 0,
+        "canceled": 0, "pending": 1, "total_amount": Decimal("100.50"),
+    }
+    other_stats = storage.get_payment_stats(tenant_id=other)
+    assert other_stats["users"]["total_users"] == 1
+    assert other_stats["payments"]["total_amount"] == Decimal("7.00")
+
+
+@pytest.mark.skipif(not PG_TEST_DSN, reason="PG_TEST_DSN не задан")
+def test_pool_replaces_dead_connections(monkeypatch, tenant):
+    db.DSN.update(parse_dsn(PG_TEST_DSN))
+    storage = PostgresStorage()
+    storage.init()
+    storage.save_user(1, tenant_id=tenant)
+
+    # Имитация перезапуска сервера: все простаивающие соединения пула убиты
+    monkeypatch.setattr(db, "PG_POOL_CHECK_IDLE_SECONDS", 0)
+    admin = psycopg2.connect(PG_TEST_DSN)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity"
+            " WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        )
+    admin.close()
+
+    assert storage.get_access_info(1, tenant_id=tenant)["is_paid"] is False
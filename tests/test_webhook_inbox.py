@@ -0,0 +1,65 @@
+"""
+process_batch без БД: запросы к webhook_inbox подменены записью вызовов,
+время — управляемыми часами, чтобы проверить границу аренды пачки.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from utils import webhook_inbox, yookassa_api
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def inbox(monkeypatch):
+    calls = {"processed": [], "completed": [], "released": [], "replay": []}
+    clock = Clock()
+
+    def process(payload, vkbot, record_status, replay):
+        calls["processed"].append(payload["n"])
+        calls["replay"].append(replay)
+        clock.now += webhook_inbox.ROW_SECONDS
+
+    monkeypatch.setattr(webhook_inbox, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(yookassa_api, "process_webhook_event", process)
+    monkeypatch.setattr(webhook_inbox, "update_payment_statuses", lambda transitions: len(transitions))
+    monkeypatch.setattr(webhook_inbox, "complete_webhooks", calls["completed"].extend)
+    monkeypatch.setattr(webhook_inbox, "release_webhooks", calls["released"].extend)
+    return calls, clock
+
+
+def rows(count):
+    return [{"id": n, "tenant_id": 0, "payment_id": f"p{n}", "payload": {"n": n}, "attempts": 1}
+            for n in range(1, count + 1)]
+
+
+def test_batch_stops_before_lease_ends(inbox):
+    calls, clock = inbox
+    # Аренды хватает ровно на три уведомления с запасом на итоговые запросы
+    deadline = clock.now + 3 * webhook_inbox.ROW_SECONDS + webhook_inbox.FINISH_SECONDS
+
+    assert webhook_inbox.process_batch(rows(5), {0: object()}, deadline) == 3
+    assert calls["processed"] == [1, 2, 3]
+    assert calls["completed"] == [1, 2, 3]
+    assert calls["released"] == [4, 5]
+
+
+def test_batch_without_deadline_processes_all(inbox):
+    calls, _ = inbox
+    assert webhook_inbox.process_batch(rows(5), {0: object()}) == 5
+    assert calls["released"] == []
+
+
+def test_retried_rows_replay_tokens(inbox):
+    calls, _ = inbox
+    batch = rows(2)
+    batch[1]["attempts"] = 2
+    webhook_inbox.process_batch(batch, {0: object()})
+    assert calls["replay"] == [False, True]
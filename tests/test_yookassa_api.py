@@ -0,0 +1,108 @@
+"""
+Создание платежа против локальной заглушки YooKassa: повтор после 202
+с тем же Idempotence-Key и учёт таких ответов предохранителем.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from yookassa import Configuration
+from yookassa.domain.exceptions import ResponseProcessingError
+
+from utils import yookassa_api
+from utils.circuit_breaker import CircuitBreaker
+from utils.tenants import Tenant
+
+PAYMENT = {
+    "id": "2d8a5d4b-000f-5000-9000-1b2c3d4e5f60",
+    "status": "pending",
+    "paid": False,
+    "amount": {"value": "499.00", "currency": "RUB"},
+    "confirmation": {"type": "redirect", "confirmation_url": "https://yoomoney.ru/checkout/test"},
+    "created_at": "2026-10-19T10:00:00.000Z",
+    "test": True,
+}
+
+PROCESSING = {"type": "processing", "retry_after": 50}
+
+
+class StubYooKassa:
+    """Отвечает 202 на первые processing_replies запросов, затем 200 с платежом"""
+
+    def __init__(self, processing_replies):
+        self.processing_replies = processing_replies
+        self.keys = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.keys.append(self.headers.get("Idempotence-Key"))
+                if len(stub.keys) <= stub.processing_replies:
+                    status, payload = 202, PROCESSING
+                else:
+                    status, payload = 200, PAYMENT
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def stub_factory(monkeypatch):
+    stubs = []
+    monkeypatch.setattr(yookassa_api, "breaker", CircuitBreaker(
+        "yookassa-test", min_timeout=1, max_timeout=5,
+        ignore_exceptions=yookassa_api.breaker.ignore_exceptions))
+
+    def factory(processing_replies):
+        stubs.append(StubYooKassa(processing_replies))
+        monkeypatch.setattr(Configuration, "api_url", stubs[-1].url)
+        return stubs[-1]
+
+    yield factory
+    for stub in stubs:
+        stub.close()
+
+
+def create(key="key-1"):
+    tenant = Tenant(0, 1, "vk", "confirm", "shop", "secret")
+    return yookassa_api._create_payment({
+        "amount": {"value": "499.00", "currency": "RUB"},
+        "confirmation": {"type": "redirect", "return_url": "https://example.com/"},
+        "capture": True,
+    }, key, tenant)
+
+
+def test_processing_reply_is_retried_with_same_key(stub_factory):
+    stub = stub_factory(processing_replies=2)
+    payment = create()
+
+    assert payment.id == PAYMENT["id"]
+    assert stub.keys == ["key-1"] * 3
+    snapshot = yookassa_api.breaker.snapshot()
+    assert snapshot["calls"] == 3
+    assert snapshot["failure_rate"] == 0.0
+
+
+def test_processing_retries_are_bounded(stub_factory):
+    stub = stub_factory(processing_replies=100)
+    with pytest.raises(ResponseProcessingError):
+        create()
+
+    assert len(stub.keys) == yookassa_api.PROCESSING_RETRIES + 1
+    assert yookassa_api.breaker.snapshot()["failure_rate"] == 0.0
@@ -0,0 +1,184 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, Tuple, Type
+from config import (
+    BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_FAILURE_RATE,
+    BREAKER_SLOW_CALL_SECONDS, BREAKER_OPEN_SECONDS, BREAKER_HALF_OPEN_PROBES,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Вызов отклонён: внешний сервис признан недоступным"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_in:.1f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для исходящих вызовов.
+
+    В скользящем окне последних вызовов считает долю ошибок и медленных
+    вызовов. Если доля превышает порог — размыкается и сразу отклоняет
+    вызовы (CircuitOpenError). Через open_seconds пропускает несколько
+    пробных вызовов (half-open): успех замыкает цепь, ошибка снова размыкает.
+
+    Таймаут адаптивный: p95 задержки успешных вызовов, умноженный на
+    timeout_multiplier и ограниченный [min_timeout, max_timeout].
+    """
+
+    def __init__(self, name: str, min_timeout: float, max_timeout: float,
+                 timeout_multiplier: float = 3.0,
+                 window: int = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = BREAKER_HALF_OPEN_PROBES,
+                 ignore_exceptions: Tuple[Type[BaseException], ...] = ()):
+        self.name = name
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.ignore_exceptions = ignore_exceptions
+
+        self.state = CLOSED
+        self._outcomes: deque = deque(maxlen=window)    # True — ошибка или медленный вызов
+        self._latencies: deque = deque(maxlen=window)   # задержки успешных вызовов
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._rejected = 0
+        self._lock = threading.Lock()
+
+    def timeout(self) -> float:
+        """Текущий таймаут для вызова"""
+        with self._lock:
+            if not self._latencies:
+                return self.max_timeout
+            ordered = sorted(self._latencies)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return max(self.min_timeout, min(self.max_timeout, p95 * self.timeout_multiplier))
+
+    def _acquire(self) -> bool:
+        """Разрешает вызов или отклоняет его; возвращает True для пробного вызова"""
+        with self._lock:
+            if self.state == OPEN:
+                elapsed = time.monotonic() - self._opened_at
+                if elapsed < self.open_seconds:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, self.open_seconds - elapsed)
+                self.state = HALF_OPEN
+                logger.info("Circuit %s half-open, probing", self.name)
+
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self._rejected += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probes_in_flight += 1
+                return True
+            return False
+
+    def _record(self, failed: bool, latency: float, probe: bool) -> None:
+        """Учитывает результат вызова и переключает состояние"""
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            if probe:
+                self._probes_in_flight -= 1
+                if failed or slow:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    logger.info("Circuit %s closed", self.name)
+
+            self._outcomes.append(failed or slow)
+            if not failed:
+                self._latencies.append(latency)
+
+            if self.state == CLOSED and len(self._outcomes) >= self.min_calls:
+                bad = sum(self._outcomes) / len(self._outcomes)
+                if bad >= self.failure_rate:
+                    self._open()
+
+    def _open(self) -> None:
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        logger.warning("Circuit %s opened", self.name)
+
+    @contextmanager
+    def guard(self):
+        """
+        Оборачивает исходящий вызов и отдаёт таймаут для него:
+
+            with breaker.guard() as timeout:
+                requests.post(url, timeout=timeout)
+
+        Исключение внутри блока считается ошибкой сервиса
+        (кроме ignore_exceptions). При разомкнутой цепи — CircuitOpenError.
+        """
+        probe = self._acquire()
+        timeout = self.timeout()
+        started = time.monotonic()
+        try:
+            yield timeout
+        except self.ignore_exceptions:
+            self._record(False, time.monotonic() - started, probe)
+            raise
+        except BaseException:
+            self._record(True, time.monotonic() - started, probe)
+            raise
+        self._record(False, time.monotonic() - started, probe)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Состояние для health check"""
+        timeout = self.timeout()
+        with self._lock:
+            calls = len(self._outcomes)
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(sum(self._outcomes) / calls, 3) if calls else 0.0,
+                "timeout": round(timeout, 3),
+                "rejected": self._rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str, **kwargs) -> CircuitBreaker:
+    """Возвращает предохранитель по имени, создавая его при первом обращении"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name, **kwargs)
+        return breaker
+
+
+def breakers_snapshot() -> Dict[str, Dict[str, Any]]:
+    """Состояние всех предохранителей процесса"""
+    with _registry_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+def any_open() -> bool:
+    """Есть ли разомкнутые предохранители"""
+    return any(info["state"] == OPEN for info in breakers_snapshot().values())
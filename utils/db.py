@@ -1,9 +1,22 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Callable
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extensions import connection as BaseConnection
+from psycopg2.extras import DictCursor, Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool, PoolError
 from contextlib import contextmanager
-from config import PG_HOST, PG_PORT, PG_USER, PG_PASSWORD, PG_DBNAME
+from collections import OrderedDict
+from config import PG_HOST, PG_PORT, PG_USER, PG_PASSWORD, PG_DBNAME, PG_CONNECT_TIMEOUT
+from config import PG_POOL_MIN, PG_POOL_MAX, PG_POOL_TIMEOUT, PG_POOL_CHECK_IDLE_SECONDS, PG_PREPARED_STATEMENTS
+from config import (
+    PG_REPLICA_HOSTS, PG_REPLICA_MAX_LAG_SECONDS, PG_REPLICA_RETRY_SECONDS,
+    PG_READ_YOUR_WRITES_SECONDS, PG_PAYMENT_RECHECK_SECONDS,
+)
+import itertools
+import os
+import threading
+import time
 import uuid
+from utils.profiling import span, traced
 import logging
 
 
@@ -15,170 +28,891 @@ DSN = {
     "user": PG_USER,
     "password": PG_PASSWORD,
     "dbname": PG_DBNAME,
+    "connect_timeout": PG_CONNECT_TIMEOUT,
 }
 
 
+def _replica_dsn(address: str) -> Dict[str, Any]:
+    host, _, port = address.partition(":")
+    return dict(DSN, host=host, port=int(port or PG_PORT))
+
+
+REPLICA_DSNS = [_replica_dsn(address) for address in PG_REPLICA_HOSTS]
+
+# Как часто перепроверять отставание реплики
+REPLICA_LAG_CHECK_SECONDS = 5
+
+# Состояние реплик: недоступна до (monotonic), время проверки и результат проверки отставания
+_replica_state = [{"down_until": 0.0, "lag_checked_at": 0.0, "lagging": False} for _ in REPLICA_DSNS]
+_replica_rr = itertools.count()
+
+# Пользователи, недавно изменённые в основной БД: (tenant_id, user_id) -> до какого момента читать с primary
+_recent_writes: "OrderedDict[Tuple[int, int], float]" = OrderedDict()
+_recent_writes_lock = threading.Lock()
+MAX_RECENT_WRITES = 100000
+
+# Схема создаётся лениво — при первом подключении, а не при импорте
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+# Платёж пользователя создан недавно и ещё может пройти (см. _read_user)
+_RECENT_PAYMENT = (f"COALESCE(p.created_at > LOCALTIMESTAMP - interval '{PG_PAYMENT_RECHECK_SECONDS:g} seconds', "
+                   f"FALSE) AS payment_recent")
+
+# Реестр частых запросов: имя -> SQL. Выполняются через execute_statement:
+# на каждом соединении PREPARE делается один раз, дальше — EXECUTE по имени
+STATEMENTS: Dict[str, str] = {
+    "save_user": """
+        INSERT INTO users (tenant_id, user_id, name, contact)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (tenant_id, user_id) DO UPDATE
+          SET name = COALESCE(EXCLUDED.name, users.name),
+              contact = COALESCE(EXCLUDED.contact, users.contact)
+    """,
+    "insert_payment": """
+        INSERT INTO payments (tenant_id, payment_id, user_vk_id, amount, currency, status)
+        VALUES (%s, %s, %s, %s, %s, 'created')
+        ON CONFLICT (payment_id) DO UPDATE SET status = EXCLUDED.status
+    """,
+    "link_user_payment": "UPDATE users SET payment_id = %s WHERE tenant_id = %s AND user_id = %s",
+    "payment_succeeded": """
+        UPDATE payments SET status = 'succeeded', updated_at = CURRENT_TIMESTAMP
+        WHERE payment_id = %s AND status <> 'succeeded'
+        RETURNING user_vk_id, tenant_id
+    """,
+    "grant_access": """
+        UPDATE users SET is_paid = TRUE, token = %s, paid_at = CURRENT_TIMESTAMP
+        WHERE tenant_id = %s AND user_id = %s
+    """,
+    "is_user_paid": f"""
+        SELECT u.is_paid, {_RECENT_PAYMENT}
+        FROM users u LEFT JOIN payments p ON p.payment_id = u.payment_id
+        WHERE u.tenant_id = %s AND u.user_id = %s
+    """,
+    "get_user_token": f"""
+        SELECT u.is_paid, u.token, {_RECENT_PAYMENT}
+        FROM users u LEFT JOIN payments p ON p.payment_id = u.payment_id
+        WHERE u.tenant_id = %s AND u.user_id = %s
+    """,
+    "find_token": "SELECT tenant_id, user_id, is_paid, token_used FROM users WHERE token = %s",
+    "use_token": "UPDATE users SET token_used = TRUE WHERE token = %s",
+    "get_access_info": f"""
+        SELECT u.is_paid, u.token, u.token_used, u.paid_at, u.contact, u.created_at, {_RECENT_PAYMENT}
+        FROM users u LEFT JOIN payments p ON p.payment_id = u.payment_id
+        WHERE u.tenant_id = %s AND u.user_id = %s
+    """,
+    "enqueue_webhook": """
+        INSERT INTO webhook_inbox (tenant_id, payment_id, payload)
+        VALUES (%s, %s, %s)
+        RETURNING id
+    """,
+}
+
+
+def _numbered(sql: str) -> str:
+    """%s -> $1, $2, ... для PREPARE"""
+    parts = sql.strip().split("%s")
+    return "".join(part + (f"${index}" if index < len(parts) else "")
+                   for index, part in enumerate(parts, start=1))
+
+
+_PREPARED_SQL = {name: _numbered(sql) for name, sql in STATEMENTS.items()}
+_PARAM_COUNT = {name: sql.count("%s") for name, sql in STATEMENTS.items()}
+
+# Статистика выполнения по операторам: calls, total, max (секунды), prepares, errors
+_statement_stats: Dict[str, Dict[str, float]] = {}
+_statement_stats_lock = threading.Lock()
+
+
+class PreparedConnection(BaseConnection):
+    """
+    Соединение пула: помнит, какие операторы реестра на нём уже подготовлены,
+    открыто ли оно к реплике и когда вернулось в пул
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.prepared_stale = False
+        self.replica = False
+        self.returned_at = time.monotonic()
+
+
+def _record_statement(name: str, elapsed: float, prepared: bool, failed: bool) -> None:
+    with _statement_stats_lock:
+        stats = _statement_stats.get(name)
+        if stats is None:
+            stats = _statement_stats[name] = {"calls": 0, "total": 0.0, "max": 0.0, "prepares": 0, "errors": 0}
+        stats["calls"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["prepares"] += prepared
+        stats["errors"] += failed
+
+
+def execute_statement(cur, name: str, params: tuple = ()) -> None:
+    """
+    Выполняет запрос из STATEMENTS. При PG_PREPARED_STATEMENTS — через подготовленный
+    оператор соединения (PREPARE при первом использовании), иначе — обычным текстом.
+    Время выполнения учитывается в statement_stats().
+    """
+    conn = cur.connection
+    use_prepared = PG_PREPARED_STATEMENTS and isinstance(conn, PreparedConnection)
+    prepared = False
+    started = time.perf_counter()
+    try:
+        if not use_prepared:
+            cur.execute(STATEMENTS[name], params)
+        else:
+            if name not in conn.prepared:
+                cur.execute(f"PREPARE {name} AS {_PREPARED_SQL[name]}")
+                conn.prepared.add(name)
+                prepared = True
+            placeholders = ", ".join(["%s"] * _PARAM_COUNT[name])
+            cur.execute(f"EXECUTE {name} ({placeholders})" if placeholders else f"EXECUTE {name}", params)
+    except psycopg2.Error:
+        if use_prepared:
+            # Набор подготовленных операторов мог разойтись с сервером — сбросим при возврате в пул
+            conn.prepared_stale = True
+        _record_statement(name, time.perf_counter() - started, prepared, True)
+        raise
+    _record_statement(name, time.perf_counter() - started, prepared, False)
+
+
+def statement_stats() -> Dict[str, Dict[str, Any]]:
+    """Статистика операторов реестра в этом процессе (время — в миллисекундах)"""
+    with _statement_stats_lock:
+        snapshot = {name: dict(stats) for name, stats in _statement_stats.items()}
+    return {
+        name: {
+            "calls": stats["calls"],
+            "total_ms": round(stats["total"] * 1000, 3),
+            "mean_ms": round(stats["total"] * 1000 / stats["calls"], 3),
+            "max_ms": round(stats["max"] * 1000, 3),
+            "prepares": stats["prepares"],
+            "errors": stats["errors"],
+        }
+        for name, stats in sorted(snapshot.items(), key=lambda item: -item[1]["total"])
+    }
+
+
+def _is_alive(conn) -> bool:
+    """Проверяет соединение, если оно простаивало дольше PG_POOL_CHECK_IDLE_SECONDS"""
+    if conn.closed:
+        return False
+    if time.monotonic() - getattr(conn, "returned_at", 0.0) < PG_POOL_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error as e:
+        logger.warning("Dropping dead pooled connection: %s", e)
+        return False
+
+
+class ConnectionPool:
+    """
+    Пул соединений, общий для всех потоков и арендаторов процесса.
+    Если свободных соединений нет, ждёт до PG_POOL_TIMEOUT секунд.
+    Соединение, простоявшее дольше PG_POOL_CHECK_IDLE_SECONDS, перед выдачей
+    проверяется (SELECT 1): после перезапуска или переключения БД мёртвые
+    соединения заменяются новыми, а не роняют запросы.
+    """
+
+    def __init__(self, dsn: Dict[str, Any], minconn: int = PG_POOL_MIN, maxconn: int = PG_POOL_MAX):
+        self._pool = ThreadedConnectionPool(minconn, maxconn, connection_factory=PreparedConnection, **dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._maxconn = maxconn
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=PG_POOL_TIMEOUT):
+            raise PoolError("Timed out waiting for a database connection")
+        try:
+            # Мёртвыми могут оказаться все простаивающие соединения; дальше пул откроет новое
+            for _ in range(self._maxconn + 1):
+                conn = self._pool.getconn()
+                if _is_alive(conn):
+                    return conn
+                self._pool.putconn(conn, close=True)
+            raise PoolError("No live database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn) -> None:
+        """Возвращает соединение; сломанное или с незавершённой транзакцией — закрывает/откатывает"""
+        try:
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                    if getattr(conn, "prepared_stale", False):
+                        with conn.cursor() as cur:
+                            cur.execute("DEALLOCATE ALL")
+                        conn.commit()
+                        conn.prepared.clear()
+                        conn.prepared_stale = False
+                except psycopg2.Error:
+                    broken = True
+            conn.returned_at = time.monotonic()
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    def closeall(self) -> None:
+        self._pool.closeall()
+
+
+# Пулы создаются лениво и заново в каждом процессе после fork:
+# соединения родителя нельзя ни использовать, ни закрывать из воркера
+_pools: Dict[Any, ConnectionPool] = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+_inherited_pools: List[ConnectionPool] = []
+
+
+def _get_pool(key: Any, dsn: Dict[str, Any]) -> ConnectionPool:
+    global _pools, _pools_pid
+    pool = _pools.get(key) if _pools_pid == os.getpid() else None
+    if pool is not None:
+        return pool
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Держим ссылки на унаследованные пулы, чтобы GC не закрыл чужие сокеты
+            _inherited_pools.extend(_pools.values())
+            _pools = {}
+            _pools_pid = os.getpid()
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = ConnectionPool(dsn)
+        return pool
+
+
+def close_pools() -> None:
+    """Закрывает пулы текущего процесса (например, в мастере gunicorn перед fork)"""
+    global _pools
+    with _pools_lock:
+        if _pools_pid == os.getpid():
+            for pool in _pools.values():
+                pool.closeall()
+        _pools = {}
+
+
 @contextmanager
 def get_conn():
-    """Контекстный менеджер для подключения к БД"""
-    conn = psycopg2.connect(**DSN)
+    """Контекстный менеджер для подключения к основной БД (из общего пула)"""
+    pool = _get_pool("primary", DSN)
+    with span("db.getconn"):
+        conn = pool.getconn()
     try:
+        if not _schema_ready:
+            _ensure_schema(conn)
         yield conn
     finally:
-        conn.close()
+        pool.putconn(conn)
+
+
+def _remember_write(user_vk_id: int, tenant_id: int = 0) -> None:
+    """Следующие чтения этого пользователя идут в основную БД (read-your-writes)"""
+    if not REPLICA_DSNS:
+        return
+    now = time.monotonic()
+    key = (tenant_id, user_vk_id)
+    with _recent_writes_lock:
+        _recent_writes.pop(key, None)
+        _recent_writes[key] = now + PG_READ_YOUR_WRITES_SECONDS
+        # Удаляем истёкшие записи с начала очереди
+        while _recent_writes:
+            oldest, until = next(iter(_recent_writes.items()))
+            if until > now and len(_recent_writes) <= MAX_RECENT_WRITES:
+                break
+            del _recent_writes[oldest]
+
+
+def _is_sticky(user_vk_id: Optional[int], tenant_id: int = 0) -> bool:
+    if user_vk_id is None:
+        return False
+    with _recent_writes_lock:
+        until = _recent_writes.get((tenant_id, user_vk_id))
+    return until is not None and until > time.monotonic()
+
+
+def _replica_lagging(index: int, conn) -> bool:
+    """Проверяет отставание реплики (результат кэшируется на REPLICA_LAG_CHECK_SECONDS)"""
+    state = _replica_state[index]
+    now = time.monotonic()
+    if now - state["lag_checked_at"] < REPLICA_LAG_CHECK_SECONDS:
+        return state["lagging"]
+
+    with conn.cursor() as cur:
+        # Если всё полученное уже применено — отставания нет, даже если primary простаивает.
+        # Но только пока WAL реально принимается: у отключившейся реплики receive = replay
+        # навсегда. Статус приёмника виден пользователю с ролью pg_read_all_stats
+        cur.execute("""
+            SELECT
+                (SELECT status FROM pg_stat_wal_receiver),
+                CASE
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END;
+        """)
+        receiver_status, lag = cur.fetchone()
+        lag = float(lag or 0)
+    conn.rollback()
+
+    state["lag_checked_at"] = now
+    if receiver_status != "streaming":
+        state["lagging"] = True
+        logger.warning("Replica %s WAL receiver is %s, reading from primary",
+                       REPLICA_DSNS[index]["host"], receiver_status or "not visible or stopped")
+        return True
+
+    state["lagging"] = lag > PG_REPLICA_MAX_LAG_SECONDS
+    if state["lagging"]:
+        logger.warning("Replica %s lags by %.1fs, reading from primary", REPLICA_DSNS[index]["host"], lag)
+    return state["lagging"]
+
+
+def _connect_replica():
+    """
+    Берёт соединение с первой исправной реплики (по кругу).
+    Возвращает (индекс, пул, соединение) или (None, None, None), если подходящих нет.
+    """
+    start = next(_replica_rr)
+    now = time.monotonic()
+    for offset in range(len(REPLICA_DSNS)):
+        index = (start + offset) % len(REPLICA_DSNS)
+        state = _replica_state[index]
+        if state["down_until"] > now:
+            continue
+        if state["lagging"] and now - state["lag_checked_at"] < REPLICA_LAG_CHECK_SECONDS:
+            continue
+        try:
+            pool = _get_pool(("replica", index), REPLICA_DSNS[index])
+            with span("db.replica_getconn"):
+                conn = pool.getconn()
+            conn.replica = True
+        except psycopg2.Error as e:
+            logger.warning("Replica %s unavailable: %s", REPLICA_DSNS[index]["host"], e)
+            state["down_until"] = now + PG_REPLICA_RETRY_SECONDS
+            continue
+        try:
+            if _replica_lagging(index, conn):
+                pool.putconn(conn)
+                continue
+        except psycopg2.Error as e:
+            logger.warning("Replica %s lag check failed: %s", REPLICA_DSNS[index]["host"], e)
+            state["down_until"] = now + PG_REPLICA_RETRY_SECONDS
+            pool.putconn(conn)
+            continue
+        return index, pool, conn
+    return None, None, None
+
+
+@contextmanager
+def get_read_conn(user_vk_id: Optional[int] = None, tenant_id: int = 0):
+    """
+    Подключение для запросов только на чтение.
+    Идёт на реплику, если она настроена, доступна и не отстаёт; иначе — на основную БД.
+    Пользователь, недавно изменённый в этом процессе, читается с основной БД.
+    """
+    if not REPLICA_DSNS or _is_sticky(user_vk_id, tenant_id):
+        with get_conn() as conn:
+            yield conn
+        return
+
+    index, pool, conn = _connect_replica()
+    if conn is None:
+        with get_conn() as conn:
+            yield conn
+        return
+
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        # Реплика отвалилась во время запроса — следующие чтения пойдут на primary
+        _replica_state[index]["down_until"] = time.monotonic() + PG_REPLICA_RETRY_SECONDS
+        raise
+    finally:
+        pool.putconn(conn)
+
+
+def _ensure_schema(conn) -> None:
+    """Создаёт таблицы один раз за процесс"""
+    global _schema_ready
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with conn.cursor() as cur:
+            # Таблица пользователей
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    tenant_id BIGINT NOT NULL DEFAULT 0,
+                    user_id BIGINT NOT NULL,
+                    name TEXT,
+                    contact TEXT,
+                    payment_id TEXT,
+                    is_paid BOOLEAN DEFAULT FALSE,
+                    token TEXT UNIQUE,
+                    token_used BOOLEAN DEFAULT FALSE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    paid_at TIMESTAMP
+                );
+            """)
+            
+            # Таблица платежей
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS payments (
+                    id SERIAL PRIMARY KEY,
+                    tenant_id BIGINT NOT NULL DEFAULT 0,
+                    payment_id TEXT UNIQUE,
+                    user_vk_id BIGINT,
+                    amount NUMERIC(10,2),
+                    currency TEXT,
+                    status TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            cur.execute("ALTER TABLE payments ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS payments_status_created_at_idx
+                ON payments (status, created_at);
+            """)
+
+            # Архив: брошенные, отменённые и неуспешные платежи старше срока хранения
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS payments_archive (
+                    id INTEGER PRIMARY KEY,
+                    tenant_id BIGINT NOT NULL DEFAULT 0,
+                    payment_id TEXT UNIQUE,
+                    user_vk_id BIGINT,
+                    amount NUMERIC(10,2),
+                    currency TEXT,
+                    status TEXT,
+                    created_at TIMESTAMP,
+                    updated_at TIMESTAMP,
+                    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+
+            # Несколько сообществ в одной БД: пользователь уникален в пределах tenant_id
+            for table in ("users", "payments", "payments_archive"):
+                cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tenant_id BIGINT NOT NULL DEFAULT 0;")
+            cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS users_tenant_user_idx ON users (tenant_id, user_id);")
+            cur.execute("ALTER TABLE users DROP CONSTRAINT IF EXISTS users_user_id_key;")
+
+            # Входящие уведомления YooKassa: сохраняются сразу, обрабатываются фоновыми воркерами
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS webhook_inbox (
+                    id BIGSERIAL PRIMARY KEY,
+                    tenant_id BIGINT NOT NULL DEFAULT 0,
+                    payment_id TEXT,
+                    payload JSONB NOT NULL,
+                    received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    locked_until TIMESTAMP,
+                    processed_at TIMESTAMP,
+                    last_error TEXT
+                );
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS webhook_inbox_pending_idx
+                ON webhook_inbox (payment_id, id) WHERE processed_at IS NULL;
+            """)
+        conn.commit()
+        _schema_ready = True
+        logger.info("Database initialized successfully")
 
 
 def init_db() -> None:
-    """Инициализация базы данных"""
+    """
+    Явная инициализация базы данных (например, при прогреве перед fork).
+    Без неё схема будет создана при первом обращении к БД.
+    """
     try:
-        with get_conn() as conn:
-            with conn.cursor() as cur:
-                # Таблица пользователей
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS users (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT UNIQUE NOT NULL,
-                        name TEXT,
-                        contact TEXT,
-                        payment_id TEXT,
-                        is_paid BOOLEAN DEFAULT FALSE,
-                        token TEXT UNIQUE,
-                        token_used BOOLEAN DEFAULT FALSE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        paid_at TIMESTAMP
-                    );
-                """)
-                
-                # Таблица платежей
-                cur.execute("""
-                    CREATE TABLE IF NOT EXISTS payments (
-                        id SERIAL PRIMARY KEY,
-                        payment_id TEXT UNIQUE,
-                        user_vk_id BIGINT,
-                        amount NUMERIC(10,2),
-                        currency TEXT,
-                        status TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    );
-                """)
-                conn.commit()
-                logger.info("Database initialized successfully")
+        with get_conn():
+            pass
     except Exception as e:
-        logger.error(f"Database initialization error: {e}")
+        logger.error("Database initialization error: %s", e)
         raise
 
 
-def save_user(user_id: int, name: Optional[str] = None, contact: Optional[str] = None) -> None:
+@traced("db.save_user")
+def save_user(user_id: int, name: Optional[str] = None, contact: Optional[str] = None,
+              tenant_id: int = 0) -> None:
     """Сохраняет или обновляет пользователя"""
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO users (user_id, name, contact)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (user_id) DO UPDATE
-                      SET name = COALESCE(EXCLUDED.name, users.name),
-                          contact = COALESCE(EXCLUDED.contact, users.contact);
-                """, (user_id, name, contact))
+                execute_statement(cur, "save_user", (tenant_id, user_id, name, contact))
                 conn.commit()
-                logger.info(f"User {user_id} saved/updated")
+                logger.info("User %s saved/updated", user_id, extra={"event": "user_saved"})
     except Exception as e:
-        logger.error(f"Error saving user {user_id}: {e}")
+        logger.error("Error saving user %s: %s", user_id, e)
         raise
 
 
-def set_payment(user_vk_id: int, payment_id: str, amount: float, currency: str = "RUB") -> None:
+@traced("db.set_payment")
+def set_payment(user_vk_id: int, payment_id: str, amount: float, currency: str = "RUB",
+                tenant_id: int = 0) -> None:
     """Создаёт платёж и связывает его с пользователем"""
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                cur.execute("""
-                    INSERT INTO payments (payment_id, user_vk_id, amount, currency, status)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (payment_id) DO UPDATE SET status = EXCLUDED.status;
-                """, (payment_id, user_vk_id, amount, currency, "created"))
-                
-                cur.execute("UPDATE users SET payment_id = %s WHERE user_id = %s;", 
-                           (payment_id, user_vk_id))
+                execute_statement(cur, "insert_payment", (tenant_id, payment_id, user_vk_id, amount, currency))
+                execute_statement(cur, "link_user_payment", (payment_id, tenant_id, user_vk_id))
                 conn.commit()
-                logger.info(f"Payment {payment_id} created for user {user_vk_id}")
+                logger.info("Payment %s created for user %s", payment_id, user_vk_id, extra={"event": "payment_saved"})
     except Exception as e:
-        logger.error(f"Error setting payment: {e}")
+        logger.error("Error setting payment: %s", e)
         raise
 
 
-def mark_paid(payment_id: str) -> Optional[str]:
+@traced("db.mark_paid")
+def mark_paid(payment_id: str, replay: bool = False) -> Optional[str]:
     """
     Отмечает платеж как успешный, генерирует уникальный токен и сохраняет его.
-    Возвращает токен или None если платеж не найден.
+    Возвращает токен или None если платеж не найден или уже был отмечен успешным
+    (повторное уведомление не должно менять уже отправленную пользователю ссылку).
+    replay — повторная обработка того же уведомления (воркер мог упасть после
+    записи, не успев отправить ссылку): для уже успешного платежа возвращается
+    действующий неиспользованный токен, чтобы отправку можно было завершить.
     """
     try:
         with get_conn() as conn:
             with conn.cursor() as cur:
-                # Обновляем статус платежа
-                cur.execute("UPDATE payments SET status = %s WHERE payment_id = %s;", 
-                           ("succeeded", payment_id))
-                
-                # Получаем user_vk_id по payment_id
-                cur.execute("SELECT user_vk_id FROM payments WHERE payment_id = %s;", 
-                           (payment_id,))
+                # Обновляем статус платежа и получаем пользователя по payment_id
+                execute_statement(cur, "payment_succeeded", (payment_id,))
                 result = cur.fetchone()
                 
                 if not result:
-                    logger.warning(f"Payment {payment_id} not found")
+                    # Платёж мог уйти в архив как брошенный — возвращаем его в рабочую таблицу
+                    cur.execute("""
+                        WITH restored AS (
+                            DELETE FROM payments_archive WHERE payment_id = %s
+                            RETURNING id, tenant_id, payment_id, user_vk_id, amount, currency, created_at
+                        )
+                        INSERT INTO payments (id, tenant_id, payment_id, user_vk_id, amount, currency, status, created_at, updated_at)
+                        SELECT id, tenant_id, payment_id, user_vk_id, amount, currency, 'succeeded', created_at, CURRENT_TIMESTAMP
+                        FROM restored
+                        RETURNING user_vk_id, tenant_id;
+                    """, (payment_id,))
+                    result = cur.fetchone()
+
+                if not result:
+                    cur.execute("""
+                        SELECT u.token, u.is_paid AND u.token_used IS NOT TRUE
+                        FROM payments p
+                        LEFT JOIN users u ON u.tenant_id = p.tenant_id AND u.user_id = p.user_vk_id
+                        WHERE p.payment_id = %s;
+                    """, (payment_id,))
+                    existing = cur.fetchone()
                     conn.commit()
+                    if not existing:
+                        logger.warning("Payment %s not found", payment_id)
+                        return None
+                    token, token_active = existing
+                    if replay and token and token_active:
+                        logger.info("Payment %s already succeeded, replaying existing token", payment_id)
+                        return token
+                    logger.info("Payment %s already succeeded, token not reissued", payment_id)
                     return None
                 
-                user_vk_id = result[0]
+                user_vk_id, tenant_id = result
+                _remember_write(user_vk_id, tenant_id)
                 
                 # Генерируем уникальный токен
                 token = str(uuid.uuid4())
                 
                 # Обновляем пользователя: отмечаем оплачено, сохраняем токен, время оплаты
-                cur.execute("""
-                    UPDATE users 
-                    SET is_paid = TRUE, token = %s, paid_at = CURRENT_TIMESTAMP
-                    WHERE user_id = %s;
-                """, (token, user_vk_id))
+                execute_statement(cur, "grant_access", (token, tenant_id, user_vk_id))
                 
                 conn.commit()
-                logger.info(f"User {user_vk_id} marked as paid, token generated: {token[:8]}...")
+                logger.info("User %s marked as paid, token generated: %s...", user_vk_id, token[:8])
                 return token
                 
     except Exception as e:
-        logger.error(f"Error marking payment as paid: {e}")
+        logger.error("Error marking payment as paid: %s", e)
         raise
 
 
-def is_user_paid(user_vk_id: int) -> bool:
-    """Проверяет, оплатил ли пользователь"""
+@traced("db.update_payment_statuses")
+def update_payment_statuses(updates: List[Tuple[str, str]]) -> int:
+    """
+    Записывает пачку переходов статусов (payment_id, status) одним запросом.
+    Меняются только платежи в статусе 'created': успешный платёж не перезаписывается.
+    Возвращает число обновлённых строк.
+    """
+    if not updates:
+        return 0
     try:
         with get_conn() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute("SELECT is_paid FROM users WHERE user_id = %s;", (user_vk_id,))
-                row = cur.fetchone()
-                return bool(row and row["is_paid"])
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    UPDATE payments AS p
+                    SET status = v.status, updated_at = CURRENT_TIMESTAMP
+                    FROM (VALUES %s) AS v(payment_id, status)
+                    WHERE p.payment_id = v.payment_id AND p.status = 'created';
+                """, updates, page_size=len(updates))
+                updated = cur.rowcount
+                conn.commit()
+                return updated
     except Exception as e:
-        logger.error(f"Error checking if user is paid: {e}")
-        return False
+        logger.error("Error updating payment statuses: %s", e)
+        raise
 
 
-def get_user_token(user_vk_id: int) -> Optional[str]:
-    """Получает токен доступа конкретного пользователя"""
+@traced("db.archive_payments")
+def archive_payments(older_than_hours: float, batch_size: int) -> int:
+    """
+    Переносит одну пачку старых незавершённых платежей ('created', 'canceled',
+    'failed') в payments_archive в отдельной короткой транзакции.
+    Возвращает число перенесённых строк.
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    WITH moved AS (
+                        DELETE FROM payments
+                        WHERE id IN (
+                            SELECT id FROM payments
+                            WHERE status IN ('created', 'canceled', 'failed')
+                              AND created_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                            ORDER BY created_at
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id, tenant_id, payment_id, user_vk_id, amount, currency, status, created_at, updated_at
+                    )
+                    INSERT INTO payments_archive (id, tenant_id, payment_id, user_vk_id, amount, currency, status, created_at, updated_at)
+                    SELECT id, tenant_id, payment_id, user_vk_id, amount, currency, status, created_at, updated_at FROM moved;
+                """, (older_than_hours * 3600, batch_size))
+                moved = cur.rowcount
+                conn.commit()
+                return moved
+    except Exception as e:
+        logger.error("Error archiving payments: %s", e)
+        raise
+
+
+@traced("db.enqueue_webhook")
+def enqueue_webhook(payment_id: Optional[str], tenant_id: int, payload: Dict[str, Any]) -> int:
+    """Сохраняет уведомление YooKassa во входящую очередь (один INSERT). Возвращает id записи"""
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                execute_statement(cur, "enqueue_webhook", (tenant_id, payment_id, Json(payload)))
+                inbox_id = cur.fetchone()[0]
+                conn.commit()
+                return inbox_id
+    except Exception as e:
+        logger.error("Error saving webhook for payment %s: %s", payment_id, e)
+        raise
+
+
+@traced("db.claim_webhooks")
+def claim_webhooks(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Забирает пачку необработанных уведомлений на lease_seconds.
+    Уведомление выдаётся, только если более ранние уведомления того же платежа
+    уже обработаны, — события одного платежа обрабатываются по порядку.
+    Запись, не завершённая до конца аренды (воркер упал), будет выдана снова.
+    """
     try:
         with get_conn() as conn:
             with conn.cursor(cursor_factory=DictCursor) as cur:
                 cur.execute("""
-                    SELECT token FROM users 
-                    WHERE user_id = %s AND is_paid = TRUE AND token IS NOT NULL;
-                """, (user_vk_id,))
+                    UPDATE webhook_inbox AS w
+                    SET locked_until = CURRENT_TIMESTAMP + make_interval(secs => %s),
+                        attempts = w.attempts + 1
+                    WHERE w.id IN (
+                        SELECT i.id FROM webhook_inbox i
+                        WHERE i.processed_at IS NULL
+                          AND (i.locked_until IS NULL OR i.locked_until < CURRENT_TIMESTAMP)
+                          AND NOT EXISTS (
+                              SELECT 1 FROM webhook_inbox e
+                              WHERE e.payment_id = i.payment_id
+                                AND e.id < i.id
+                                AND e.processed_at IS NULL
+                          )
+                        ORDER BY i.id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING w.id, w.tenant_id, w.payment_id, w.payload, w.attempts;
+                """, (lease_seconds, limit))
+                rows = [dict(row) for row in cur.fetchall()]
+                conn.commit()
+                rows.sort(key=lambda row: row["id"])
+                return rows
+    except Exception as e:
+        logger.error("Error claiming webhooks: %s", e)
+        raise
+
+
+@traced("db.complete_webhooks")
+def complete_webhooks(inbox_ids: List[int]) -> None:
+    """Отмечает пачку уведомлений обработанными одним запросом"""
+    if not inbox_ids:
+        return
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE webhook_inbox
+                    SET processed_at = CURRENT_TIMESTAMP, locked_until = NULL, last_error = NULL
+                    WHERE id = ANY(%s);
+                """, (list(inbox_ids),))
+                conn.commit()
+    except Exception as e:
+        logger.error("Error completing webhooks: %s", e)
+        raise
+
+
+@traced("db.release_webhooks")
+def release_webhooks(inbox_ids: List[int]) -> None:
+    """
+    Возвращает в очередь уведомления, до которых пачка не дошла до конца аренды:
+    снимает аренду и не засчитывает попытку
+    """
+    if not inbox_ids:
+        return
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE webhook_inbox
+                    SET locked_until = NULL, attempts = attempts - 1
+                    WHERE id = ANY(%s) AND processed_at IS NULL;
+                """, (list(inbox_ids),))
+                conn.commit()
+    except Exception as e:
+        logger.error("Error releasing webhooks: %s", e)
+        raise
+
+
+@traced("db.retry_webhook")
+def retry_webhook(inbox_id: int, error: str, max_attempts: int, max_delay_seconds: float) -> bool:
+    """
+    Откладывает повтор уведомления с экспоненциальной паузой. После max_attempts
+    попыток запись закрывается с ошибкой, чтобы не блокировать следующие события
+    этого платежа. Возвращает True, если попытки исчерпаны.
+    """
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE webhook_inbox
+                    SET last_error = %s,
+                        locked_until = CURRENT_TIMESTAMP + make_interval(secs => LEAST(%s, power(2, attempts))),
+                        processed_at = CASE WHEN attempts >= %s THEN CURRENT_TIMESTAMP END
+                    WHERE id = %s
+                    RETURNING processed_at IS NOT NULL;
+                """, (error[:1000], max_delay_seconds, max_attempts, inbox_id))
                 row = cur.fetchone()
-                return row["token"] if row else None
+                conn.commit()
+                return bool(row and row[0])
     except Exception as e:
-        logger.error(f"Error getting user token: {e}")
+        logger.error("Error rescheduling webhook %s: %s", inbox_id, e)
+        raise
+
+
+@traced("db.purge_webhooks")
+def purge_webhooks(older_than_hours: float, batch_size: int) -> int:
+    """Удаляет одну пачку давно обработанных уведомлений. Возвращает число удалённых строк"""
+    try:
+        with get_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    DELETE FROM webhook_inbox
+                    WHERE id IN (
+                        SELECT id FROM webhook_inbox
+                        WHERE processed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                        ORDER BY id
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    );
+                """, (older_than_hours * 3600, batch_size))
+                deleted = cur.rowcount
+                conn.commit()
+                return deleted
+    except Exception as e:
+        logger.error("Error purging webhooks: %s", e)
+        raise
+
+
+def _read(read: Callable[[Any], Any], user_vk_id: Optional[int] = None, tenant_id: int = 0):
+    """
+    Выполняет read(conn) на соединении для чтения (get_read_conn). Если реплика
+    оборвала соединение посреди запроса (перезапуск, устаревшее соединение в пуле),
+    чтение один раз повторяется на основной БД.
+    Возвращает (результат, прочитано ли с реплики).
+    """
+    from_replica = False
+    try:
+        with get_read_conn(user_vk_id, tenant_id) as conn:
+            from_replica = conn.replica
+            return read(conn), from_replica
+    except psycopg2.OperationalError as e:
+        if not from_replica:
+            raise
+        logger.warning("Replica read failed, retrying on primary: %s", e)
+    with get_conn() as conn:
+        return read(conn), False
+
+
+def _read_user(statement: str, user_vk_id: int, tenant_id: int = 0):
+    """
+    Читает строку пользователя запросом statement (со столбцами is_paid и payment_recent).
+    Платёж мог пройти в другом воркере, о котором этот процесс не знает, а реплика —
+    ещё не догнать primary. Поэтому неоплаченный пользователь с платежом, созданным
+    не раньше PG_PAYMENT_RECHECK_SECONDS назад, прочитанный с реплики, перечитывается
+    с основной БД. Брошенные старые платежи читаются только с реплики.
+    """
+    def fetch(conn):
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            execute_statement(cur, statement, (tenant_id, user_vk_id))
+            return cur.fetchone()
+
+    row, from_replica = _read(fetch, user_vk_id, tenant_id)
+    if not from_replica or not row or row["is_paid"] or not row["payment_recent"]:
+        return row
+
+    with get_conn() as conn:
+        row = fetch(conn)
+    if row and row["is_paid"]:
+        _remember_write(user_vk_id, tenant_id)
+    return row
+
+
+@traced("db.is_user_paid")
+def is_user_paid(user_vk_id: int, tenant_id: int = 0) -> bool:
+    """Проверяет, оплатил ли пользователь"""
+    try:
+        row = _read_user("is_user_paid", user_vk_id, tenant_id)
+        return bool(row and row["is_paid"])
+    except Exception as e:
+        logger.error("Error checking if user is paid: %s", e)
+        return False
+
+
+@traced("db.get_user_token")
+def get_user_token(user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+    """Получает токен доступа конкретного пользователя"""
+    try:
+        row = _read_user("get_user_token", user_vk_id, tenant_id)
+        return row["token"] if row and row["is_paid"] else None
+    except Exception as e:
+        logger.error("Error getting user token: %s", e)
         return None
 
 
+@traced("db.verify_access_token")
 def verify_access_token(token: str) -> Dict[str, Any]:
     """
     Проверяет валидность токена доступа.
@@ -187,10 +921,7 @@ def verify_access_token(token: str) -> Dict[str, Any]:
     try:
         with get_conn() as conn:
             with conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute("""
-                    SELECT user_id, is_paid, token_used FROM users 
-                    WHERE token = %s;
-                """, (token,))
+                execute_statement(cur, "find_token", (token,))
                 row = cur.fetchone()
                 
                 # Токен не существует
@@ -218,14 +949,12 @@ def verify_access_token(token: str) -> Dict[str, Any]:
                     }
                 
                 # Отмечаем токен как использованный
-                cur.execute("""
-                    UPDATE users SET token_used = TRUE 
-                    WHERE token = %s;
-                """, (token,))
+                execute_statement(cur, "use_token", (token,))
                 conn.commit()
+                _remember_write(row["user_id"], row["tenant_id"])
                 
                 # Токен валиден
-                logger.info(f"Token verified for user {row['user_id']}")
+                logger.info("Token verified for user %s", row['user_id'])
                 return {
                     "valid": True,
                     "message": "Доступ разрешён",
@@ -233,7 +962,7 @@ def verify_access_token(token: str) -> Dict[str, Any]:
                 }
                 
     except Exception as e:
-        logger.error(f"Error verifying access token: {e}")
+        logger.error("Error verifying access token: %s", e)
         return {
             "valid": False,
             "message": "Ошибка сервера",
@@ -241,7 +970,8 @@ def verify_access_token(token: str) -> Dict[str, Any]:
         }
 
 
-def renew_user_token(user_vk_id: int) -> Optional[str]:
+@traced("db.renew_user_token")
+def renew_user_token(user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
     """
     Генерирует новый токен для пользователя (для продления доступа).
     Возвращает новый токен или None если пользователь не найден.
@@ -253,21 +983,23 @@ def renew_user_token(user_vk_id: int) -> Optional[str]:
                 cur.execute("""
                     UPDATE users 
                     SET token = %s, token_used = FALSE
-                    WHERE user_id = %s AND is_paid = TRUE;
-                """, (new_token, user_vk_id))
+                    WHERE tenant_id = %s AND user_id = %s AND is_paid = TRUE;
+                """, (new_token, tenant_id, user_vk_id))
                 conn.commit()
                 
                 if cur.rowcount > 0:
-                    logger.info(f"New token generated for user {user_vk_id}")
+                    _remember_write(user_vk_id, tenant_id)
+                    logger.info("New token generated for user %s", user_vk_id)
                     return new_token
                 return None
                 
     except Exception as e:
-        logger.error(f"Error renewing user token: {e}")
+        logger.error("Error renewing user token: %s", e)
         return None
 
 
-def revoke_access(user_vk_id: int) -> bool:
+@traced("db.revoke_access")
+def revoke_access(user_vk_id: int, tenant_id: int = 0) -> bool:
     """Отзывает доступ пользователя (блокирует токен)"""
     try:
         with get_conn() as conn:
@@ -275,84 +1007,82 @@ def revoke_access(user_vk_id: int) -> bool:
                 cur.execute("""
                     UPDATE users 
                     SET is_paid = FALSE, token = NULL, token_used = TRUE
-                    WHERE user_id = %s;
-                """, (user_vk_id,))
+                    WHERE tenant_id = %s AND user_id = %s;
+                """, (tenant_id, user_vk_id))
                 conn.commit()
-                logger.info(f"Access revoked for user {user_vk_id}")
+                _remember_write(user_vk_id, tenant_id)
+                logger.info("Access revoked for user %s", user_vk_id)
                 return cur.rowcount > 0
                 
     except Exception as e:
-        logger.error(f"Error revoking access: {e}")
+        logger.error("Error revoking access: %s", e)
         return False
 
 
-def get_access_info(user_vk_id: int) -> Dict[str, Any]:
+@traced("db.get_access_info")
+def get_access_info(user_vk_id: int, tenant_id: int = 0) -> Dict[str, Any]:
     """Получает полную информацию о доступе пользователя"""
     try:
-        with get_conn() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        is_paid,
-                        token,
-                        token_used,
-                        paid_at,
-                        contact,
-                        created_at
-                    FROM users 
-                    WHERE user_id = %s;
-                """, (user_vk_id,))
-                row = cur.fetchone()
-                
-                if not row:
-                    return {"error": "Пользователь не найден"}
-                
-                return {
-                    "is_paid": row["is_paid"],
-                    "has_token": row["token"] is not None,
-                    "token_used": row["token_used"],
-                    "paid_at": row["paid_at"],
-                    "contact": row["contact"],
-                    "created_at": row["created_at"]
-                }
-                
+        row = _read_user("get_access_info", user_vk_id, tenant_id)
+        if not row:
+            return {"error": "Пользователь не найден"}
+
+        return {
+            "is_paid": row["is_paid"],
+            "has_token": row["token"] is not None,
+            "token_used": row["token_used"],
+            "paid_at": row["paid_at"],
+            "contact": row["contact"],
+            "created_at": row["created_at"]
+        }
+
     except Exception as e:
-        logger.error(f"Error getting access info: {e}")
+        logger.error("Error getting access info: %s", e)
         return {"error": str(e)}
 
 
-def get_payment_stats() -> Dict[str, Any]:
-    """Получает статистику платежей"""
+@traced("db.get_payment_stats")
+def get_payment_stats(tenant_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Получает статистику платежей (по рабочей таблице, без архива).
+    Если tenant_id не указан — по всем сообществам.
+    """
+    where, params = ("WHERE tenant_id = %s", (tenant_id,)) if tenant_id is not None else ("", ())
+
+    def fetch(conn):
+        with conn.cursor(cursor_factory=DictCursor) as cur:
+            cur.execute("""
+                SELECT 
+                    COUNT(*) as total_users,
+                    SUM(CASE WHEN is_paid THEN 1 ELSE 0 END) as paid_users,
+                    SUM(CASE WHEN token_used THEN 1 ELSE 0 END) as accessed_users
+                FROM users {where};
+            """.format(where=where), params)
+            users_stat = cur.fetchone()
+            
+            cur.execute("""
+                SELECT 
+                    COUNT(*) as total_payments,
+                    SUM(CASE WHEN status = 'succeeded' THEN 1 ELSE 0 END) as succeeded,
+                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed,
+                    SUM(CASE WHEN status = 'canceled' THEN 1 ELSE 0 END) as canceled,
+                    SUM(CASE WHEN status = 'created' THEN 1 ELSE 0 END) as pending,
+                    SUM(amount) as total_amount
+                FROM payments {where};
+            """.format(where=where), params)
+            payment_stat = cur.fetchone()
+            
+            return {
+                "users": dict(users_stat),
+                "payments": dict(payment_stat)
+            }
+
     try:
-        with get_conn() as conn:
-            with conn.cursor(cursor_factory=DictCursor) as cur:
-                cur.execute("""
-                    SELECT 
-                        COUNT(*) as total_users,
-                        SUM(CASE WHEN is_paid THEN 1 ELSE 0 END) as paid_users,
-                        SUM(CASE WHEN token_used THEN 1 ELSE 0 END) as accessed_users
-                    FROM users;
-                """)
-                users_stat = cur.fetchone()
-                
-                cur.execute("""
-                    SELECT 
-                        COUNT(*) as total_payments,
-                        SUM(CASE WHEN status = 'succeeded' THEN 1 ELSE 0 END) as succeeded,
-                        SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) as failed,
-                        SUM(CASE WHEN status = 'created' THEN 1 ELSE 0 END) as pending,
-                        SUM(amount) as total_amount
-                    FROM payments;
-                """)
-                payment_stat = cur.fetchone()
-                
-                return {
-                    "users": dict(users_stat),
-                    "payments": dict(payment_stat)
-                }
+        stats, _ = _read(fetch)
+        return stats
                 
     except Exception as e:
-        logger.error(f"Error getting payment stats: {e}")
+        logger.error("Error getting payment stats: %s", e)
         return {
             "users": {},
             "payments": {}
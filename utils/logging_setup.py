@@ -0,0 +1,161 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Идентификаторы текущего запроса и события (VK event_id / id платежа YooKassa)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+event_id_var: ContextVar[Optional[str]] = ContextVar("event_id", default=None)
+
+_queue: Optional[queue.Queue] = None
+_handler: Optional[logging.handlers.QueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+_settings: Dict = {}
+
+
+def parse_sampling(value: str) -> Dict[str, float]:
+    """Разбирает строку вида 'vk_callback_received:0.01,message_sent:0.1'"""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, rate = item.partition(":")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись request_id и event_id (выполняется в потоке запроса)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        record.event_id = event_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Сэмплирует высокочастотные INFO/DEBUG записи, помеченные extra={"event": ...}.
+    WARNING и выше, а также непомеченные записи пропускаются всегда.
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: Optional[Dict[str, float]] = None):
+        super().__init__()
+        self.default_rate = default_rate
+        self.rates = rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        event = getattr(record, "event", None)
+        if event is None:
+            return True
+        rate = self.rates.get(event, self.default_rate)
+        return rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("event", "request_id", "event_id"):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Кладёт запись в очередь без форматирования — сообщение собирается
+    в фоновом потоке. При переполнении очереди INFO/DEBUG отбрасываются,
+    ошибки ждут места в очереди.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno >= logging.ERROR:
+                self.queue.put(record)
+
+
+def setup_logging(level: str = "INFO", fmt: str = "json", sample_rate: float = 1.0,
+                  sampling: str = "", queue_size: int = 10000) -> None:
+    """
+    Настраивает корневой логгер: запись в очередь в потоке запроса,
+    форматирование и вывод в stderr — в фоновом потоке.
+    Повторный вызов переконфигурирует логирование.
+    """
+    global _queue, _handler
+    _settings.update(fmt=fmt, queue_size=queue_size)
+
+    _queue = queue.Queue(maxsize=queue_size)
+    _handler = NonBlockingQueueHandler(_queue)
+    _handler.addFilter(ContextFilter())
+    _handler.addFilter(SamplingFilter(sample_rate, parse_sampling(sampling)))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(_handler)
+    root.setLevel(level)
+
+    _start_listener()
+
+
+def _start_listener() -> None:
+    """Запускает фоновый поток, который пишет записи из очереди в stderr"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream = logging.StreamHandler()
+    if _settings.get("fmt") == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    _listener = logging.handlers.QueueListener(_queue, stream)
+    _listener.start()
+
+
+def _restart_after_fork() -> None:
+    """
+    Поток-писатель не переживает fork (preload_app): в воркере создаём
+    новую очередь (замок старой мог остаться захваченным) и новый поток.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        _listener = None
+        _queue = queue.Queue(maxsize=_settings["queue_size"])
+        _handler.queue = _queue
+        _start_listener()
+
+
+def stop_logging() -> None:
+    """Дописывает оставшиеся записи и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(stop_logging)
@@ -0,0 +1,179 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional
+import requests
+from config import LONGPOLL_WAIT, LONGPOLL_WORKERS, LONGPOLL_TS_FILE
+from utils.vk_api_wrapper import API_URL, API_VERSION
+from utils.logging_setup import event_id_var
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LongPollError(Exception):
+    """Ошибка VK API при работе с Bots Long Poll"""
+
+
+class LongPollRunner:
+    """
+    Получение событий через VK Bots Long Poll API вместо Callback-эндпоинта.
+
+    События забираются пачками и передаются в те же хэндлеры VKBot.
+    Сообщения разных пользователей обрабатываются параллельно, сообщения
+    одного пользователя — по порядку. ts сохраняется в файл после обработки
+    пачки, поэтому после перезапуска чтение продолжается с того же места
+    (последняя пачка может быть обработана повторно, но не потеряна).
+    """
+
+    def __init__(self, vkbot, group_id: int, wait: int = LONGPOLL_WAIT,
+                 workers: int = LONGPOLL_WORKERS, ts_file: Optional[str] = LONGPOLL_TS_FILE,
+                 api_url: str = API_URL, token: Optional[str] = None):
+        if not group_id:
+            # groups.getLongPollServer без group_id отвечает ошибкой — не запускаемся вовсе
+            raise ValueError("Long Poll requires group_id (VK_GROUP_ID)")
+        self.vkbot = vkbot
+        self.group_id = group_id
+        self.wait = wait
+        self.ts_file = ts_file
+        self.api_url = api_url
+        self.token = token or vkbot.token
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="longpoll")
+        self.server: Optional[str] = None
+        self.key: Optional[str] = None
+        self.ts: Optional[str] = self._load_ts()
+        self._next_ts: Optional[str] = None
+        self._stop = threading.Event()
+
+    def _load_ts(self) -> Optional[str]:
+        """Читает сохранённый ts, если он есть"""
+        if not self.ts_file:
+            return None
+        try:
+            with open(self.ts_file, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _save_ts(self) -> None:
+        """Атомарно сохраняет ts (через временный файл)"""
+        if not self.ts_file or self.ts is None:
+            return
+        tmp_path = f"{self.ts_file}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(self.ts))
+        os.replace(tmp_path, self.ts_file)
+
+    def update_server(self, update_ts: bool = True) -> None:
+        """Получает адрес сервера и ключ (и при необходимости свежий ts)"""
+        # Токен — в теле запроса: URL попадает в тексты исключений requests, а они — в лог
+        response = self.session.post(self.api_url + "groups.getLongPollServer", data={
+            "group_id": self.group_id,
+            "access_token": self.token,
+            "v": API_VERSION,
+        }, timeout=10).json()
+
+        if "error" in response:
+            raise LongPollError(response["error"])
+
+        result = response["response"]
+        self.server = result["server"]
+        self.key = result["key"]
+        if update_ts or self.ts is None:
+            self.ts = result["ts"]
+        logger.info("Long Poll server updated, ts=%s", self.ts)
+
+    def poll(self) -> List[Dict[str, Any]]:
+        """
+        Один запрос к Long Poll серверу. Возвращает пачку событий
+        и обрабатывает коды failed согласно документации VK.
+        """
+        response = self.session.get(self.server, params={
+            "act": "a_check",
+            "key": self.key,
+            "ts": self.ts,
+            "wait": self.wait,
+        }, timeout=self.wait + 10).json()
+
+        failed = response.get("failed")
+        if failed == 1:
+            # История устарела или частично утеряна — продолжаем с нового ts
+            logger.warning("Long Poll history lost, continuing from ts=%s", response["ts"])
+            self.ts = response["ts"]
+            self._save_ts()
+            return []
+        if failed == 2:
+            self.update_server(update_ts=False)
+            return []
+        if failed == 3:
+            logger.warning("Long Poll session lost, requesting new key and ts")
+            self.update_server(update_ts=True)
+            self._save_ts()
+            return []
+
+        self._next_ts = response["ts"]
+        return response.get("updates", [])
+
+    def process_batch(self, updates: List[Dict[str, Any]]) -> None:
+        """
+        Обрабатывает пачку событий: группирует по отправителю и выполняет
+        группы параллельно, сохраняя порядок внутри группы.
+        """
+        groups: Dict[Any, List[Dict[str, Any]]] = {}
+        for update in updates:
+            if update.get("type") != "message_new":
+                continue
+            from_id = update.get("object", {}).get("message", {}).get("from_id")
+            groups.setdefault(from_id, []).append(update)
+
+        futures = [self.executor.submit(self._process_group, group) for group in groups.values()]
+        wait(futures)
+
+    def _process_group(self, updates: List[Dict[str, Any]]) -> None:
+        """Последовательно обрабатывает события одного пользователя"""
+        for update in updates:
+            event_id_var.set(update.get("event_id"))
+            try:
+                self.vkbot.handle_event(update, self.vkbot)
+            except Exception as exc:
+                logger.error("Long Poll event error: %s", exc, exc_info=True)
+
+    def run_once(self) -> int:
+        """Получает и обрабатывает одну пачку, затем сохраняет ts"""
+        updates = self.poll()
+        if updates:
+            self.process_batch(updates)
+        if self._next_ts is not None:
+            self.ts = self._next_ts
+            self._next_ts = None
+            self._save_ts()
+        return len(updates)
+
+    def run_forever(self) -> None:
+        """
+        Основной цикл. Сервер запрашивается и при старте, и после ошибок внутри цикла:
+        сетевые ошибки и ошибки VK повторяются с растущей паузой, а не завершают поток.
+        """
+        backoff = 1
+        logger.info("Long Poll runner started for group %s", self.group_id)
+
+        while not self._stop.is_set():
+            try:
+                if self.server is None:
+                    # ts сохраняется: без сохранённого update_server возьмёт ts сервера
+                    self.update_server(update_ts=False)
+                self.run_once()
+                backoff = 1
+            except (requests.RequestException, ValueError, KeyError, LongPollError) as exc:
+                logger.error("Long Poll error: %s", exc)
+                self.server = None
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 60)
+
+        self.executor.shutdown(wait=True)
+        logger.info("Long Poll runner stopped")
+
+    def stop(self) -> None:
+        """Останавливает цикл после текущего запроса"""
+        self._stop.set()
@@ -0,0 +1,23 @@
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict
+import logging
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_PATH = Path(__file__).parent.parent / "static" / "messages.json"
+
+
+@lru_cache(maxsize=None)
+def get_messages() -> Dict[str, str]:
+    """
+    Загружает каталог сообщений бота при первом обращении.
+    Результат кэшируется на весь процесс (и разделяется воркерами при preload_app).
+    """
+    try:
+        with open(MESSAGES_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.error("Error loading messages: %s", e)
+        return {}
@@ -0,0 +1,190 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+from config import PROFILE_KEEP, PROFILE_MAX_SECONDS
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Интервалы текущего профилируемого запроса; None — профилирование выключено
+_spans_var: ContextVar[Optional["SpanRecorder"]] = ContextVar("profile_spans", default=None)
+
+# cProfile в Python 3.12+ нельзя включить в двух потоках одновременно —
+# профилируем не больше одного запроса за раз
+_profile_lock = threading.Lock()
+_sample_lock = threading.Lock()
+
+# Последние отчёты: id -> текст
+_reports: "OrderedDict[str, str]" = OrderedDict()
+_reports_lock = threading.Lock()
+
+
+class SpanRecorder:
+    """Интервалы (БД, исходящие HTTP) одного профилируемого запроса"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[tuple] = []
+
+    def add(self, name: str, started: float, finished: float) -> None:
+        self.spans.append((name, started - self.started, finished - started))
+
+    def format(self) -> str:
+        lines = [f"{'offset_ms':>10} {'duration_ms':>12}  span"]
+        for name, offset, duration in self.spans:
+            lines.append(f"{offset * 1000:10.1f} {duration * 1000:12.1f}  {name}")
+        total = sum(duration for _, _, duration in self.spans)
+        lines.append(f"{len(self.spans)} spans, {total * 1000:.1f} ms total")
+        return "\n".join(lines)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Отмечает интервал внутри профилируемого запроса:
+
+        with span("http.vk.messages.send"):
+            ...
+
+    Вне профилирования — одна проверка ContextVar.
+    """
+    recorder = _spans_var.get()
+    if recorder is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.add(name, started, time.perf_counter())
+
+
+def traced(name: str):
+    """Декоратор: весь вызов функции — интервал name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            recorder = _spans_var.get()
+            if recorder is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.add(name, started, time.perf_counter())
+        return wrapper
+    return decorator
+
+
+class RequestProfile:
+    """cProfile и интервалы одного запроса (X-Profile: 1 вместе с секретом администратора)"""
+
+    def __init__(self, profile_id: str):
+        self.profile_id = profile_id
+        self.recorder = SpanRecorder()
+        self.profiler = cProfile.Profile()
+        self._token = None
+
+    def start(self) -> None:
+        self._token = _spans_var.set(self.recorder)
+        self.profiler.enable()
+
+    def stop(self, limit: int = 40) -> str:
+        """Останавливает профилирование и сохраняет отчёт"""
+        self.profiler.disable()
+        _spans_var.reset(self._token)
+        _profile_lock.release()
+
+        elapsed = time.perf_counter() - self.recorder.started
+        out = io.StringIO()
+        out.write(f"request {self.profile_id}: {elapsed * 1000:.1f} ms\n\n")
+        out.write(self.recorder.format())
+        out.write("\n\n")
+        pstats.Stats(self.profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+        report = out.getvalue()
+        save_report(self.profile_id, report)
+        return report
+
+
+def start_request_profile(profile_id: str) -> Optional[RequestProfile]:
+    """Начинает профилирование запроса; None, если уже профилируется другой"""
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profile = RequestProfile(profile_id)
+    try:
+        profile.start()
+    except Exception:
+        _profile_lock.release()
+        raise
+    return profile
+
+
+def save_report(report_id: str, report: str) -> None:
+    with _reports_lock:
+        _reports[report_id] = report
+        while len(_reports) > PROFILE_KEEP:
+            _reports.popitem(last=False)
+
+
+def get_report(report_id: str) -> Optional[str]:
+    with _reports_lock:
+        return _reports.get(report_id)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Optional[str]:
+    """
+    Статистический профайлер: seconds секунд снимает стеки всех потоков процесса
+    с шагом interval и возвращает их в свёрнутом виде (одна строка на стек:
+    "поток;кадр;кадр N") — формат flamegraph.pl / speedscope.
+    Выполняется в вызвавшем потоке; остальные потоки не останавливаются
+    и не инструментируются. Возвращает None, если выборка уже идёт.
+    """
+    if not _sample_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = max(0.0, min(seconds, PROFILE_MAX_SECONDS))
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        samples = 0
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(stack))] += 1
+            samples += 1
+            time.sleep(interval)
+        logger.info("Sampled %s stacks over %.1fs", samples, seconds)
+        return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+    finally:
+        _sample_lock.release()
+
+
+def profiling_status() -> Dict[str, Any]:
+    with _reports_lock:
+        reports = list(_reports)
+    return {
+        "request_profile_running": _profile_lock.locked(),
+        "sampling_running": _sample_lock.locked(),
+        "reports": reports,
+    }
@@ -0,0 +1,109 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Решения лимитера для входящего сообщения
+ALLOW = "allow"
+NOTIFY = "notify"   # лимит превышен впервые — отправляем одно предупреждение
+DROP = "drop"       # лимит превышен повторно — молча отбрасываем
+
+# Классы команд: у каждого своя стоимость для БД и внешних сервисов
+PAYMENT = "payment"  # e-mail → создание платежа в YooKassa
+QUERY = "query"      # 'доступ' / 'статус' → запросы в БД
+DEFAULT = "default"  # всё остальное
+
+QUERY_COMMANDS = ("доступ", "статус")
+
+
+def parse_rate(value: str) -> Tuple[float, float]:
+    """
+    Разбирает лимит вида '3/60' (3 сообщения за 60 секунд).
+    Возвращает (ёмкость корзины, скорость пополнения в токенах/сек).
+    """
+    count, _, period = value.partition("/")
+    capacity = float(count)
+    seconds = float(period or 1)
+    if capacity <= 0 or seconds <= 0:
+        raise ValueError(f"Invalid rate limit: {value!r}")
+    return capacity, capacity / seconds
+
+
+def classify_message(text: str) -> str:
+    """Определяет класс команды так же, как это делают хэндлеры"""
+    text = (text or "").strip()
+    if "@" in text and "." in text:
+        return PAYMENT
+    if text.lower() in QUERY_COMMANDS:
+        return QUERY
+    return DEFAULT
+
+
+class RateLimiter:
+    """
+    Token bucket на пару (from_id, класс команды).
+
+    Состояние корзины хранится компактным кортежем (токены, время, уведомлён)
+    в OrderedDict с LRU-вытеснением: записей не больше max_entries.
+    Корзина, простоявшая дольше времени полного пополнения, неотличима от новой,
+    поэтому такие записи удаляются с начала очереди при каждом обращении.
+    """
+
+    def __init__(self, limits: Dict[str, str], max_entries: int = 100000):
+        self.limits = {name: parse_rate(rate) for name, rate in limits.items()}
+        if DEFAULT not in self.limits:
+            raise ValueError("Rate limits must define a 'default' class")
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[Tuple[int, str], Tuple[float, float, bool]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, user_id: int, command_class: str = DEFAULT, now: Optional[float] = None) -> str:
+        """
+        Списывает токен у пользователя и возвращает ALLOW, NOTIFY или DROP.
+        NOTIFY возвращается один раз за период превышения лимита.
+        """
+        capacity, rate = self.limits.get(command_class) or self.limits[DEFAULT]
+        now = time.monotonic() if now is None else now
+        key = (user_id, command_class)
+
+        with self._lock:
+            state = self._buckets.pop(key, None)
+            if state is None:
+                tokens, notified = capacity, False
+            else:
+                tokens, last, notified = state
+                tokens = min(capacity, tokens + (now - last) * rate)
+
+            if tokens >= 1:
+                decision = ALLOW
+                tokens -= 1
+                notified = False
+            elif notified:
+                decision = DROP
+            else:
+                decision = NOTIFY
+                notified = True
+
+            self._buckets[key] = (tokens, now, notified)
+            self._expire(now)
+
+        return decision
+
+    def _expire(self, now: float) -> None:
+        """
+        Удаляет с начала LRU-очереди полностью пополнившиеся корзины,
+        а при переполнении — самые давние независимо от состояния.
+        """
+        while self._buckets:
+            key, (tokens, last, _) = next(iter(self._buckets.items()))
+            capacity, rate = self.limits.get(key[1]) or self.limits[DEFAULT]
+            expired = tokens + (now - last) * rate >= capacity
+            if not expired and len(self._buckets) <= self.max_entries:
+                break
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
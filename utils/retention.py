@@ -0,0 +1,126 @@
+import atexit
+import os
+import threading
+import time
+from typing import Dict
+from config import (
+    RETENTION_ENABLED, RETENTION_FLUSH_SECONDS, RETENTION_ARCHIVE_SECONDS,
+    RETENTION_ARCHIVE_AFTER_HOURS, RETENTION_BATCH_SIZE, RETENTION_MAX_BATCHES,
+    WEBHOOK_KEEP_HOURS, STORAGE_BACKEND,
+)
+from utils.db import archive_payments, purge_webhooks
+from utils.storage import get_storage
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Пауза между пачками архивации, чтобы не занимать БД длинной серией транзакций
+BATCH_PAUSE_SECONDS = 0.1
+
+# Накопленные переходы статусов: payment_id -> status (более поздний перезаписывает)
+_pending: Dict[str, str] = {}
+_pending_lock = threading.Lock()
+_wakeup = threading.Event()
+_worker_pid = None
+_worker_lock = threading.Lock()
+
+
+def record_payment_status(payment_id: str, status: str) -> None:
+    """
+    Ставит переход статуса ('canceled', 'failed') в очередь на запись.
+    Фоновый поток записывает накопленное одним запросом раз в RETENTION_FLUSH_SECONDS.
+    """
+    with _pending_lock:
+        _pending[payment_id] = status
+        full = len(_pending) >= RETENTION_BATCH_SIZE
+    start_retention_worker()
+    if full:
+        _wakeup.set()
+
+
+def flush_statuses() -> int:
+    """Записывает накопленные переходы статусов пачками; при ошибке возвращает их в очередь"""
+    global _pending
+    with _pending_lock:
+        batch, _pending = _pending, {}
+    if not batch:
+        return 0
+
+    items = list(batch.items())
+    written = 0
+    for start in range(0, len(items), RETENTION_BATCH_SIZE):
+        chunk = items[start:start + RETENTION_BATCH_SIZE]
+        try:
+            written += get_storage().update_payment_statuses(chunk)
+        except Exception as e:
+            logger.error("Status flush failed, %s transitions requeued: %s", len(items) - start, e)
+            with _pending_lock:
+                for payment_id, status in items[start:]:
+                    _pending.setdefault(payment_id, status)
+            break
+    return written
+
+
+def run_archival() -> int:
+    """
+    Переносит старые незавершённые платежи в архив пачками по RETENTION_BATCH_SIZE,
+    каждая в своей транзакции; не больше RETENTION_MAX_BATCHES пачек за цикл.
+    """
+    total = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        moved = archive_payments(RETENTION_ARCHIVE_AFTER_HOURS, RETENTION_BATCH_SIZE)
+        total += moved
+        if moved < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(BATCH_PAUSE_SECONDS)
+    if total:
+        logger.info("Archived %s payments", total)
+    return total
+
+
+def purge_inbox() -> int:
+    """Удаляет обработанные уведомления YooKassa старше WEBHOOK_KEEP_HOURS"""
+    total = 0
+    for _ in range(RETENTION_MAX_BATCHES):
+        deleted = purge_webhooks(WEBHOOK_KEEP_HOURS, RETENTION_BATCH_SIZE)
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        time.sleep(BATCH_PAUSE_SECONDS)
+    if total:
+        logger.info("Purged %s processed webhooks", total)
+    return total
+
+
+def _worker() -> None:
+    next_archival = time.monotonic()
+    while True:
+        _wakeup.wait(RETENTION_FLUSH_SECONDS)
+        _wakeup.clear()
+        try:
+            flush_statuses()
+            # Архив и очередь уведомлений есть только в PostgreSQL
+            if RETENTION_ENABLED and STORAGE_BACKEND == "postgres" and time.monotonic() >= next_archival:
+                run_archival()
+                purge_inbox()
+                next_archival = time.monotonic() + RETENTION_ARCHIVE_SECONDS
+        except Exception as e:
+            logger.error("Retention worker error: %s", e)
+
+
+def start_retention_worker() -> None:
+    """
+    Запускает фоновый поток в текущем процессе (один на процесс).
+    После fork поток нужно запустить заново — проверяем pid.
+    """
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        threading.Thread(target=_worker, name="retention", daemon=True).start()
+        _worker_pid = os.getpid()
+
+
+atexit.register(flush_statuses)
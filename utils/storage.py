@@ -0,0 +1,118 @@
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple
+from config import STORAGE_BACKEND
+from utils import db
+
+
+class Storage:
+    """
+    Хранилище пользователей и платежей, которым пользуются хэндлеры, webhook и /verify-token.
+
+    Реализации: PostgresStorage (продакшен, utils/db.py), MemoryStorage и SQLiteStorage
+    (тесты и бенчмарки без внешних сервисов). Семантика методов у всех одинакова —
+    как у функций utils/db.py с теми же именами.
+    """
+
+    name = ""
+
+    def init(self) -> None:
+        """Создаёт схему (если нужно)"""
+
+    def save_user(self, user_id: int, name: Optional[str] = None, contact: Optional[str] = None,
+                  tenant_id: int = 0) -> None:
+        """Создаёт пользователя или обновляет переданные (не None) поля"""
+        raise NotImplementedError
+
+    def set_payment(self, user_vk_id: int, payment_id: str, amount: float, currency: str = "RUB",
+                    tenant_id: int = 0) -> None:
+        """Создаёт платёж в статусе 'created' и привязывает его к пользователю"""
+        raise NotImplementedError
+
+    def mark_paid(self, payment_id: str, replay: bool = False) -> Optional[str]:
+        """
+        Отмечает платёж успешным и выдаёт пользователю новый токен.
+        None — платёж не найден или уже успешен (токен повторно не выдаётся).
+        replay=True (повтор того же уведомления) для уже успешного платежа
+        возвращает действующий неиспользованный токен пользователя
+        """
+        raise NotImplementedError
+
+    def update_payment_statuses(self, updates: List[Tuple[str, str]]) -> int:
+        """Переводит платежи из 'created' в переданные статусы; возвращает число изменённых"""
+        raise NotImplementedError
+
+    def is_user_paid(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        raise NotImplementedError
+
+    def get_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        """Токен оплатившего пользователя или None"""
+        raise NotImplementedError
+
+    def verify_access_token(self, token: str) -> Dict[str, Any]:
+        """Проверяет токен и отмечает его использованным: {"valid", "message", "user_id"}"""
+        raise NotImplementedError
+
+    def renew_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        """Новый неиспользованный токен для оплатившего пользователя или None"""
+        raise NotImplementedError
+
+    def revoke_access(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        """Снимает оплату и токен; False — пользователь не найден"""
+        raise NotImplementedError
+
+    def get_access_info(self, user_vk_id: int, tenant_id: int = 0) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def get_payment_stats(self, tenant_id: Optional[int] = None) -> Dict[str, Any]:
+        """Счётчики пользователей и платежей; без tenant_id — по всем сообществам"""
+        raise NotImplementedError
+
+
+class PostgresStorage(Storage):
+    """Продакшен-хранилище: функции utils/db.py (пул, реплики, read-your-writes)"""
+
+    name = "postgres"
+
+    init = staticmethod(db.init_db)
+    save_user = staticmethod(db.save_user)
+    set_payment = staticmethod(db.set_payment)
+    mark_paid = staticmethod(db.mark_paid)
+    update_payment_statuses = staticmethod(db.update_payment_statuses)
+    is_user_paid = staticmethod(db.is_user_paid)
+    get_user_token = staticmethod(db.get_user_token)
+    verify_access_token = staticmethod(db.verify_access_token)
+    renew_user_token = staticmethod(db.renew_user_token)
+    revoke_access = staticmethod(db.revoke_access)
+    get_access_info = staticmethod(db.get_access_info)
+    get_payment_stats = staticmethod(db.get_payment_stats)
+
+
+@lru_cache(maxsize=None)
+def get_storage() -> Storage:
+    """
+    Хранилище процесса, выбранное STORAGE_BACKEND: postgres (по умолчанию), sqlite или memory.
+    Создаётся при первом обращении.
+    """
+    if STORAGE_BACKEND == "postgres":
+        return PostgresStorage()
+    if STORAGE_BACKEND == "sqlite":
+        from utils.storage_sqlite import SQLiteStorage
+        return SQLiteStorage()
+    if STORAGE_BACKEND == "memory":
+        from utils.storage_memory import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+def check_token_row(row: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Результат verify_access_token по строке пользователя с этим токеном
+    (как в utils/db.py). valid — токен можно отметить использованным.
+    """
+    if not row:
+        return {"valid": False, "message": "Токен не найден или истёк", "user_id": None}
+    if not row["is_paid"]:
+        return {"valid": False, "message": "Оплата не найдена", "user_id": row["user_id"]}
+    if row["token_used"]:
+        return {"valid": False, "message": "Токен уже был использован", "user_id": row["user_id"]}
+    return {"valid": True, "message": "Доступ разрешён", "user_id": row["user_id"]}
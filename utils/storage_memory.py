@@ -0,0 +1,186 @@
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Tuple
+from utils.storage import Storage, check_token_row
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+
+class MemoryStorage(Storage):
+    """
+    Хранилище в памяти процесса (STORAGE_BACKEND=memory): для тестов и бенчмарков.
+    Данные не переживают перезапуск и не разделяются между воркерами gunicorn.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[Tuple[int, int], Dict[str, Any]] = {}
+        self._payments: Dict[str, Dict[str, Any]] = {}
+        self._tokens: Dict[str, Tuple[int, int]] = {}
+        self._lock = threading.Lock()
+
+    def _set_token(self, user: Dict[str, Any], key: Tuple[int, int], token: Optional[str]) -> None:
+        if user["token"] is not None:
+            self._tokens.pop(user["token"], None)
+        user["token"] = token
+        if token is not None:
+            self._tokens[token] = key
+
+    def save_user(self, user_id: int, name: Optional[str] = None, contact: Optional[str] = None,
+                  tenant_id: int = 0) -> None:
+        with self._lock:
+            user = self._users.get((tenant_id, user_id))
+            if user is None:
+                self._users[(tenant_id, user_id)] = {
+                    "user_id": user_id, "name": name, "contact": contact, "payment_id": None,
+                    "is_paid": False, "token": None, "token_used": False,
+                    "created_at": datetime.now(), "paid_at": None,
+                }
+            else:
+                if name is not None:
+                    user["name"] = name
+                if contact is not None:
+                    user["contact"] = contact
+        logger.info("User %s saved/updated", user_id, extra={"event": "user_saved"})
+
+    def set_payment(self, user_vk_id: int, payment_id: str, amount: float, currency: str = "RUB",
+                    tenant_id: int = 0) -> None:
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None:
+                self._payments[payment_id] = {
+                    "tenant_id": tenant_id, "user_vk_id": user_vk_id,
+                    "amount": Decimal(str(amount)).quantize(CENT), "currency": currency,
+                    "status": "created", "created_at": datetime.now(), "updated_at": None,
+                }
+            else:
+                payment["status"] = "created"
+            user = self._users.get((tenant_id, user_vk_id))
+            if user is not None:
+                user["payment_id"] = payment_id
+        logger.info("Payment %s created for user %s", payment_id, user_vk_id, extra={"event": "payment_saved"})
+
+    def mark_paid(self, payment_id: str, replay: bool = False) -> Optional[str]:
+        with self._lock:
+            payment = self._payments.get(payment_id)
+            if payment is None:
+                logger.warning("Payment %s not found", payment_id)
+                return None
+            if payment["status"] == "succeeded":
+                user = self._users.get((payment["tenant_id"], payment["user_vk_id"]))
+                if replay and user is not None and user["is_paid"] and user["token"] and not user["token_used"]:
+                    logger.info("Payment %s already succeeded, replaying existing token", payment_id)
+                    return user["token"]
+                logger.info("Payment %s already succeeded, token not reissued", payment_id)
+                return None
+            payment["status"] = "succeeded"
+            payment["updated_at"] = datetime.now()
+
+            token = str(uuid.uuid4())
+            key = (payment["tenant_id"], payment["user_vk_id"])
+            user = self._users.get(key)
+            if user is not None:
+                self._set_token(user, key, token)
+                user["is_paid"] = True
+                user["paid_at"] = datetime.now()
+        logger.info("User %s marked as paid, token generated: %s...", payment["user_vk_id"], token[:8])
+        return token
+
+    def update_payment_statuses(self, updates: List[Tuple[str, str]]) -> int:
+        updated = 0
+        with self._lock:
+            for payment_id, status in updates:
+                payment = self._payments.get(payment_id)
+                if payment is not None and payment["status"] == "created":
+                    payment["status"] = status
+                    payment["updated_at"] = datetime.now()
+                    updated += 1
+        return updated
+
+    def is_user_paid(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        user = self._users.get((tenant_id, user_vk_id))
+        return bool(user and user["is_paid"])
+
+    def get_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        user = self._users.get((tenant_id, user_vk_id))
+        if user and user["is_paid"]:
+            return user["token"]
+        return None
+
+    def verify_access_token(self, token: str) -> Dict[str, Any]:
+        with self._lock:
+            key = self._tokens.get(token)
+            user = self._users.get(key) if key else None
+            result = check_token_row(user)
+            if result["valid"]:
+                user["token_used"] = True
+        if result["valid"]:
+            logger.info("Token verified for user %s", result["user_id"])
+        return result
+
+    def renew_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        key = (tenant_id, user_vk_id)
+        with self._lock:
+            user = self._users.get(key)
+            if not user or not user["is_paid"]:
+                return None
+            new_token = str(uuid.uuid4())
+            self._set_token(user, key, new_token)
+            user["token_used"] = False
+        logger.info("New token generated for user %s", user_vk_id)
+        return new_token
+
+    def revoke_access(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        key = (tenant_id, user_vk_id)
+        with self._lock:
+            user = self._users.get(key)
+            if user is None:
+                return False
+            self._set_token(user, key, None)
+            user["is_paid"] = False
+            user["token_used"] = True
+        logger.info("Access revoked for user %s", user_vk_id)
+        return True
+
+    def get_access_info(self, user_vk_id: int, tenant_id: int = 0) -> Dict[str, Any]:
+        user = self._users.get((tenant_id, user_vk_id))
+        if not user:
+            return {"error": "Пользователь не найден"}
+        return {
+            "is_paid": user["is_paid"],
+            "has_token": user["token"] is not None,
+            "token_used": user["token_used"],
+            "paid_at": user["paid_at"],
+            "contact": user["contact"],
+            "created_at": user["created_at"],
+        }
+
+    def get_payment_stats(self, tenant_id: Optional[int] = None) -> Dict[str, Any]:
+        with self._lock:
+            users = [user for (user_tenant, _), user in self._users.items()
+                     if tenant_id is None or user_tenant == tenant_id]
+            payments = [payment for payment in self._payments.values()
+                        if tenant_id is None or payment["tenant_id"] == tenant_id]
+
+        users_stat = {
+            "total_users": len(users),
+            "paid_users": _sql_sum(users, (1 for user in users if user["is_paid"])),
+            "accessed_users": _sql_sum(users, (1 for user in users if user["token_used"])),
+        }
+        payment_stat = {"total_payments": len(payments)}
+        for key, status in (("succeeded", "succeeded"), ("failed", "failed"),
+                            ("canceled", "canceled"), ("pending", "created")):
+            payment_stat[key] = _sql_sum(payments, (1 for payment in payments if payment["status"] == status))
+        payment_stat["total_amount"] = _sql_sum(payments, (payment["amount"] for payment in payments))
+        return {"users": users_stat, "payments": payment_stat}
+
+
+def _sql_sum(rows: list, values) -> Optional[Any]:
+    """Как SUM в SQL: по пустому набору строк — None"""
+    return sum(values) if rows else None
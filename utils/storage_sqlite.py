@@ -0,0 +1,218 @@
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Dict, Any, List, Tuple
+from config import SQLITE_PATH
+from utils.storage import Storage, check_token_row
+import logging
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+
+class SQLiteStorage(Storage):
+    """
+    Хранилище в SQLite (STORAGE_BACKEND=sqlite, файл SQLITE_PATH; по умолчанию —
+    в памяти): для тестов и бенчмарков. Одно соединение на процесс, запросы
+    выполняются по очереди. Суммы хранятся в копейках.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.init()
+
+    def init(self) -> None:
+        with self._lock, self._conn:
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS users (
+                    tenant_id INTEGER NOT NULL DEFAULT 0,
+                    user_id INTEGER NOT NULL,
+                    name TEXT,
+                    contact TEXT,
+                    payment_id TEXT,
+                    is_paid INTEGER NOT NULL DEFAULT 0,
+                    token TEXT UNIQUE,
+                    token_used INTEGER NOT NULL DEFAULT 0,
+                    created_at TEXT,
+                    paid_at TEXT,
+                    PRIMARY KEY (tenant_id, user_id)
+                );
+                CREATE TABLE IF NOT EXISTS payments (
+                    payment_id TEXT PRIMARY KEY,
+                    tenant_id INTEGER NOT NULL DEFAULT 0,
+                    user_vk_id INTEGER,
+                    amount_cents INTEGER,
+                    currency TEXT,
+                    status TEXT,
+                    created_at TEXT,
+                    updated_at TEXT
+                );
+            """)
+
+    def _fetchone(self, query: str, params: tuple = ()) -> Optional[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(query, params).fetchone()
+
+    def _update(self, query: str, params: tuple = ()) -> int:
+        """Изменяющий запрос в отдельной транзакции; возвращает число затронутых строк"""
+        with self._lock, self._conn:
+            return self._conn.execute(query, params).rowcount
+
+    def save_user(self, user_id: int, name: Optional[str] = None, contact: Optional[str] = None,
+                  tenant_id: int = 0) -> None:
+        self._update("""
+            INSERT INTO users (tenant_id, user_id, name, contact, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (tenant_id, user_id) DO UPDATE
+              SET name = COALESCE(excluded.name, users.name),
+                  contact = COALESCE(excluded.contact, users.contact);
+        """, (tenant_id, user_id, name, contact, datetime.now().isoformat()))
+        logger.info("User %s saved/updated", user_id, extra={"event": "user_saved"})
+
+    def set_payment(self, user_vk_id: int, payment_id: str, amount: float, currency: str = "RUB",
+                    tenant_id: int = 0) -> None:
+        cents = int(Decimal(str(amount)).quantize(CENT) * 100)
+        with self._lock, self._conn:
+            self._conn.execute("""
+                INSERT INTO payments (tenant_id, payment_id, user_vk_id, amount_cents, currency, status, created_at)
+                VALUES (?, ?, ?, ?, ?, 'created', ?)
+                ON CONFLICT (payment_id) DO UPDATE SET status = excluded.status;
+            """, (tenant_id, payment_id, user_vk_id, cents, currency, datetime.now().isoformat()))
+            self._conn.execute("UPDATE users SET payment_id = ? WHERE tenant_id = ? AND user_id = ?;",
+                               (payment_id, tenant_id, user_vk_id))
+        logger.info("Payment %s created for user %s", payment_id, user_vk_id, extra={"event": "payment_saved"})
+
+    def mark_paid(self, payment_id: str, replay: bool = False) -> Optional[str]:
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT user_vk_id, tenant_id, status FROM payments WHERE payment_id = ?;",
+                                     (payment_id,)).fetchone()
+            if not row:
+                logger.warning("Payment %s not found", payment_id)
+                return None
+            if row["status"] == "succeeded":
+                user = self._conn.execute("""
+                    SELECT token FROM users
+                    WHERE tenant_id = ? AND user_id = ? AND is_paid = 1 AND NOT token_used AND token IS NOT NULL;
+                """, (row["tenant_id"], row["user_vk_id"])).fetchone()
+                if replay and user:
+                    logger.info("Payment %s already succeeded, replaying existing token", payment_id)
+                    return user["token"]
+                logger.info("Payment %s already succeeded, token not reissued", payment_id)
+                return None
+            self._conn.execute("UPDATE payments SET status = 'succeeded', updated_at = ? WHERE payment_id = ?;",
+                               (now, payment_id))
+
+            token = str(uuid.uuid4())
+            self._conn.execute("""
+                UPDATE users SET is_paid = 1, token = ?, paid_at = ?
+                WHERE tenant_id = ? AND user_id = ?;
+            """, (token, now, row["tenant_id"], row["user_vk_id"]))
+        logger.info("User %s marked as paid, token generated: %s...", row["user_vk_id"], token[:8])
+        return token
+
+    def update_payment_statuses(self, updates: List[Tuple[str, str]]) -> int:
+        if not updates:
+            return 0
+        now = datetime.now().isoformat()
+        with self._lock, self._conn:
+            cur = self._conn.executemany("""
+                UPDATE payments SET status = ?, updated_at = ?
+                WHERE payment_id = ? AND status = 'created';
+            """, [(status, now, payment_id) for payment_id, status in updates])
+            return cur.rowcount
+
+    def is_user_paid(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        row = self._fetchone("SELECT is_paid FROM users WHERE tenant_id = ? AND user_id = ?;",
+                             (tenant_id, user_vk_id))
+        return bool(row and row["is_paid"])
+
+    def get_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        row = self._fetchone("""
+            SELECT token FROM users
+            WHERE tenant_id = ? AND user_id = ? AND is_paid = 1 AND token IS NOT NULL;
+        """, (tenant_id, user_vk_id))
+        return row["token"] if row else None
+
+    def verify_access_token(self, token: str) -> Dict[str, Any]:
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT user_id, is_paid, token_used FROM users WHERE token = ?;",
+                                     (token,)).fetchone()
+            result = check_token_row(row)
+            if result["valid"]:
+                self._conn.execute("UPDATE users SET token_used = 1 WHERE token = ?;", (token,))
+        if result["valid"]:
+            logger.info("Token verified for user %s", result["user_id"])
+        return result
+
+    def renew_user_token(self, user_vk_id: int, tenant_id: int = 0) -> Optional[str]:
+        new_token = str(uuid.uuid4())
+        updated = self._update("""
+            UPDATE users SET token = ?, token_used = 0
+            WHERE tenant_id = ? AND user_id = ? AND is_paid = 1;
+        """, (new_token, tenant_id, user_vk_id))
+        if updated > 0:
+            logger.info("New token generated for user %s", user_vk_id)
+            return new_token
+        return None
+
+    def revoke_access(self, user_vk_id: int, tenant_id: int = 0) -> bool:
+        updated = self._update("""
+            UPDATE users SET is_paid = 0, token = NULL, token_used = 1
+            WHERE tenant_id = ? AND user_id = ?;
+        """, (tenant_id, user_vk_id))
+        logger.info("Access revoked for user %s", user_vk_id)
+        return updated > 0
+
+    def get_access_info(self, user_vk_id: int, tenant_id: int = 0) -> Dict[str, Any]:
+        row = self._fetchone("""
+            SELECT is_paid, token, token_used, paid_at, contact, created_at
+            FROM users WHERE tenant_id = ? AND user_id = ?;
+        """, (tenant_id, user_vk_id))
+        if not row:
+            return {"error": "Пользователь не найден"}
+        return {
+            "is_paid": bool(row["is_paid"]),
+            "has_token": row["token"] is not None,
+            "token_used": bool(row["token_used"]),
+            "paid_at": _parse_time(row["paid_at"]),
+            "contact": row["contact"],
+            "created_at": _parse_time(row["created_at"]),
+        }
+
+    def get_payment_stats(self, tenant_id: Optional[int] = None) -> Dict[str, Any]:
+        where, params = ("WHERE tenant_id = ?", (tenant_id,)) if tenant_id is not None else ("", ())
+        with self._lock:
+            users_stat = self._conn.execute(f"""
+                SELECT
+                    COUNT(*) AS total_users,
+                    SUM(is_paid) AS paid_users,
+                    SUM(token_used) AS accessed_users
+                FROM users {where};
+            """, params).fetchone()
+            payment_stat = self._conn.execute(f"""
+                SELECT
+                    COUNT(*) AS total_payments,
+                    SUM(CASE WHEN status = 'succeeded' THEN 1 ELSE 0 END) AS succeeded,
+                    SUM(CASE WHEN status = 'failed' THEN 1 ELSE 0 END) AS failed,
+                    SUM(CASE WHEN status = 'canceled' THEN 1 ELSE 0 END) AS canceled,
+                    SUM(CASE WHEN status = 'created' THEN 1 ELSE 0 END) AS pending,
+                    SUM(amount_cents) AS total_amount
+                FROM payments {where};
+            """, params).fetchone()
+
+        payments = dict(payment_stat)
+        if payments["total_amount"] is not None:
+            payments["total_amount"] = (Decimal(payments["total_amount"]) / 100).quantize(CENT)
+        return {"users": dict(users_stat), "payments": payments}
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
@@ -0,0 +1,100 @@
+import json
+import threading
+from typing import Dict, Optional
+from config import (
+    TENANTS_FILE, VK_GROUP_ID, VK_GROUP_TOKEN, VK_CONFIRMATION_TOKEN,
+    YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сообщество из переменных окружения (режим одного сообщества)
+DEFAULT_TENANT_ID = 0
+
+
+class Tenant:
+    """
+    Сообщество VK, обслуживаемое этим процессом: свои токены VK и свой магазин YooKassa.
+    tenant_id разделяет данные сообществ в общих таблицах.
+    """
+
+    def __init__(self, tenant_id: int, group_id: int, vk_group_token: Optional[str],
+                 vk_confirmation_token: Optional[str], yookassa_shop_id: Optional[str],
+                 yookassa_secret_key: Optional[str]):
+        self.tenant_id = tenant_id
+        self.group_id = group_id
+        self.vk_group_token = vk_group_token
+        self.vk_confirmation_token = vk_confirmation_token
+        self.yookassa_shop_id = yookassa_shop_id
+        self.yookassa_secret_key = yookassa_secret_key
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "Tenant":
+        group_id = int(data["group_id"])
+        # Пустой токен не должен молча подменяться токеном из переменных окружения
+        for field in ("vk_group_token", "vk_confirmation_token"):
+            if not isinstance(data.get(field), str) or not data[field].strip():
+                raise ValueError(f"Tenant {group_id}: {field} must be a non-empty string")
+        return cls(
+            tenant_id=int(data.get("tenant_id", group_id)),
+            group_id=group_id,
+            vk_group_token=data["vk_group_token"],
+            vk_confirmation_token=data["vk_confirmation_token"],
+            yookassa_shop_id=str(data["yookassa_shop_id"]),
+            yookassa_secret_key=data["yookassa_secret_key"],
+        )
+
+
+_tenants: Optional[Dict[int, Tenant]] = None
+_by_group: Dict[int, Tenant] = {}
+_tenants_lock = threading.Lock()
+
+
+def load_tenants() -> Dict[int, Tenant]:
+    """
+    Загружает сообщества (один раз на процесс).
+
+    TENANTS_FILE — JSON-список объектов с полями group_id, vk_group_token,
+    vk_confirmation_token, yookassa_shop_id, yookassa_secret_key и необязательным
+    tenant_id (по умолчанию равен group_id). Без файла — одно сообщество
+    из VK_* / YOOKASSA_* с tenant_id = 0, как до появления мультиарендности.
+    """
+    global _tenants, _by_group
+    if _tenants is not None:
+        return _tenants
+    with _tenants_lock:
+        if _tenants is not None:
+            return _tenants
+
+        if TENANTS_FILE:
+            with open(TENANTS_FILE, encoding="utf-8") as f:
+                tenants = [Tenant.from_dict(item) for item in json.load(f)]
+        else:
+            tenants = [Tenant(DEFAULT_TENANT_ID, VK_GROUP_ID, VK_GROUP_TOKEN, VK_CONFIRMATION_TOKEN,
+                              YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)]
+
+        by_id = {tenant.tenant_id: tenant for tenant in tenants}
+        if len(by_id) != len(tenants):
+            raise ValueError(f"Duplicate tenant_id in {TENANTS_FILE}")
+        _by_group = {tenant.group_id: tenant for tenant in tenants}
+        _tenants = by_id
+        logger.info("Loaded %s tenant(s)", len(by_id))
+        return _tenants
+
+
+def get_tenant(group_id: Optional[int]) -> Optional[Tenant]:
+    """
+    Сообщество по group_id из события VK. Без TENANTS_FILE единственное
+    сообщество обслуживает любой group_id (VK_GROUP_ID может быть не задан).
+    """
+    tenants = load_tenants()
+    tenant = _by_group.get(group_id)
+    if tenant is None and not TENANTS_FILE:
+        tenant = tenants[DEFAULT_TENANT_ID]
+    return tenant
+
+
+def get_tenant_by_id(tenant_id: int) -> Optional[Tenant]:
+    """Сообщество по tenant_id (из БД или метаданных платежа)"""
+    return load_tenants().get(tenant_id)
@@ -1,42 +1,96 @@
 import requests
 import uuid
-from config import VK_GROUP_TOKEN
-from typing import Dict, Any
+from config import VK_GROUP_TOKEN, VK_API_URL, RATE_LIMIT_ENABLED, RATE_LIMIT_MAX_USERS, RATE_LIMITS
+from config import VK_TIMEOUT_MIN, VK_TIMEOUT_MAX
+from utils.rate_limiter import RateLimiter, classify_message, ALLOW, NOTIFY
+from utils.circuit_breaker import get_breaker, CircuitOpenError
+from utils.profiling import span
+from typing import Dict, Any, Optional
+from utils.messages import get_messages
 import logging
 
 logger = logging.getLogger(__name__)
 
-API_URL = "https://api.vk.com/method/"
+API_URL = VK_API_URL
 API_VERSION = "5.131"
 
+# Коды ошибок VK API, означающие проблемы на стороне VK (а не в запросе)
+VK_SERVER_ERRORS = (1, 6, 10)
+
+# Одна HTTP-сессия (пул keep-alive соединений к api.vk.com) на все сообщества процесса
+session = requests.Session()
+
+
+class VKServerError(Exception):
+    """Ошибка на стороне VK API — учитывается предохранителем"""
+
 
 class VKBot:
     """
     Обёртка для VK Callback API.
     Регистрирует обработчики, принимает события и вызывает их по очереди.
+    Один экземпляр на сообщество: свой токен, свой лимитер и свой предохранитель
+    (лимиты VK, например ошибка 6, действуют на токен и не должны размыкать цепь
+    остальным сообществам).
     """
 
-    def __init__(self):
-        self.token = VK_GROUP_TOKEN
+    def __init__(self, token: Optional[str] = None, group_id: int = 0, tenant_id: int = 0,
+                 rate_limiter: Optional[RateLimiter] = None):
+        # None — сообщество из переменных окружения; у сообществ из TENANTS_FILE токен свой всегда
+        self.token = VK_GROUP_TOKEN if token is None else token
+        self.group_id = group_id
+        self.tenant_id = tenant_id
+        self.breaker = get_breaker(f"vk:{group_id}" if group_id else "vk",
+                                   min_timeout=VK_TIMEOUT_MIN, max_timeout=VK_TIMEOUT_MAX)
         self.handlers = []
+        if rate_limiter is None and RATE_LIMIT_ENABLED:
+            rate_limiter = RateLimiter(RATE_LIMITS, max_entries=RATE_LIMIT_MAX_USERS)
+        self.rate_limiter = rate_limiter
 
     def register_handler(self, func):
         """
         Регистрирует функцию-обработчик. Функция должна принимать параметры event и vkbot.
         """
         self.handlers.append(func)
-        logger.info(f"Handler registered: {func.__name__}")
+        logger.info("Handler registered: %s", func.__name__)
 
     def handle_event(self, data: Dict[str, Any], vkbot) -> None:
         """
         Делегирует событие всем зарегистрированным хэндлерам.
         Каждый хэндлер решает, нужно ли ему обрабатывать событие.
+        Сообщения сверх лимита пользователя до хэндлеров не доходят.
         """
+        if not self._within_rate_limit(data):
+            return
+
         for handler in self.handlers:
             try:
                 handler(data, vkbot)
             except Exception as exc:
-                logger.error(f"Handler error in {handler.__name__}: {exc}", exc_info=True)
+                logger.error("Handler error in %s: %s", handler.__name__, exc, exc_info=True)
+
+    def _within_rate_limit(self, data: Dict[str, Any]) -> bool:
+        """
+        Проверяет лимит отправителя. При первом превышении отправляет
+        одно предупреждение, дальнейшие сообщения молча отбрасывает.
+        """
+        if self.rate_limiter is None:
+            return True
+
+        obj = data.get("object", {}).get("message", {})
+        from_id = obj.get("from_id")
+        if not from_id:
+            return True
+
+        decision = self.rate_limiter.check(from_id, classify_message(obj.get("text", "")))
+        if decision == ALLOW:
+            return True
+
+        if decision == NOTIFY:
+            logger.warning("Rate limit exceeded for user %s", from_id)
+            self.send_message(from_id, get_messages().get("rate_limited",
+                "⏳ Слишком много сообщений. Подождите немного и повторите."))
+        return False
 
     def send_message(self, user_id: int, text: str) -> Dict[str, Any]:
         """
@@ -50,16 +104,22 @@ class VKBot:
                 "access_token": self.token,
                 "v": API_VERSION
             }
-            response = requests.post(API_URL + "messages.send", params=params, timeout=10)
-            result = response.json()
+            with self.breaker.guard() as timeout, span("http.vk.messages.send"):
+                response = session.post(API_URL + "messages.send", data=params, timeout=timeout)
+                result = response.json()
+                if result.get("error", {}).get("error_code") in VK_SERVER_ERRORS:
+                    raise VKServerError(result["error"])
             
             if "error" in result:
-                logger.error(f"VK API error: {result['error']}")
+                logger.error("VK API error: %s", result['error'])
                 return {}
             
-            logger.info(f"Message sent to user {user_id}")
+            logger.info("Message sent to user %s", user_id, extra={"event": "message_sent"})
             return result
             
+        except CircuitOpenError as e:
+            logger.warning("Message to %s not sent: %s", user_id, e)
+            return {}
         except Exception as e:
-            logger.error(f"Error sending message to {user_id}: {e}")
+            logger.error("Error sending message to %s: %s", user_id, e)
             return {}
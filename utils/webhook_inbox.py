@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from config import (
+    WEBHOOK_WORKERS, WEBHOOK_BATCH_SIZE, WEBHOOK_POLL_SECONDS, WEBHOOK_LEASE_SECONDS,
+    WEBHOOK_MAX_ATTEMPTS, WEBHOOK_MAX_RETRY_DELAY, VK_TIMEOUT_MAX, PG_POOL_TIMEOUT,
+)
+from utils.db import (
+    enqueue_webhook, claim_webhooks, complete_webhooks, release_webhooks, retry_webhook, update_payment_statuses,
+)
+from utils.logging_setup import event_id_var
+from utils.retention import record_payment_status
+import logging
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+# Худшее время одного уведомления (два сообщения VK) и запас на итоговые запросы
+# пачки: уведомление берётся в работу, только если успеет до конца аренды
+ROW_SECONDS = 2 * VK_TIMEOUT_MAX
+FINISH_SECONDS = 2 * PG_POOL_TIMEOUT
+
+
+def accept_webhook(payment_id: Optional[str], tenant_id: int, payload: Dict[str, Any]) -> int:
+    """
+    Сохраняет уведомление во входящую очередь и будит воркеры этого процесса.
+    Обработка (mark_paid, сообщения VK) выполняется в фоне.
+    """
+    inbox_id = enqueue_webhook(payment_id, tenant_id, payload)
+    _wakeup.set()
+    return inbox_id
+
+
+def process_batch(rows: List[Dict[str, Any]], vkbots: Dict[int, Any], lease_deadline: Optional[float] = None) -> int:
+    """
+    Обрабатывает пачку уведомлений. Переходы 'canceled'/'failed' всей пачки
+    записываются одним запросом, затем обработанные уведомления отмечаются —
+    даже если запись переходов не удалась (её досылает буфер utils/retention.py),
+    иначе повтор пачки снова отправил бы пользователям сообщения VK.
+    Неудачное уведомление откладывается на повтор, остальные не задерживает.
+    lease_deadline (time.monotonic()) — конец аренды пачки: уведомления, которые
+    не успеют обработаться до него, возвращаются в очередь, чтобы их не взял
+    другой воркер, пока этот ещё отправляет сообщения.
+    Возвращает число обработанных уведомлений.
+    """
+    from utils.yookassa_api import process_webhook_event
+
+    transitions: List[Tuple[str, str]] = []
+    done: List[int] = []
+    for index, row in enumerate(rows):
+        if lease_deadline is not None and time.monotonic() + ROW_SECONDS + FINISH_SECONDS > lease_deadline:
+            released = [rest["id"] for rest in rows[index:]]
+            logger.warning("Webhook lease running out, releasing %s notifications", len(released))
+            try:
+                release_webhooks(released)
+            except Exception as e:
+                # Не вышло — записи вернутся в работу, когда истечёт аренда
+                logger.error("Releasing webhooks failed: %s", e)
+            break
+        event_id_var.set(row["payment_id"])
+        try:
+            vkbot = vkbots.get(row["tenant_id"])
+            if vkbot is None:
+                raise LookupError(f"Unknown tenant {row['tenant_id']}")
+            # Повторная выдача: прошлая попытка могла записать оплату, но не отправить ссылку
+            process_webhook_event(row["payload"], vkbot,
+                                  record_status=lambda payment_id, status: transitions.append((payment_id, status)),
+                                  replay=row["attempts"] > 1)
+            done.append(row["id"])
+        except Exception as e:
+            try:
+                dropped = retry_webhook(row["id"], str(e), WEBHOOK_MAX_ATTEMPTS, WEBHOOK_MAX_RETRY_DELAY)
+            except Exception as retry_error:
+                # Повтор не записан — уведомление вернётся в работу, когда истечёт аренда
+                logger.error("Webhook %s failed: %s; retry not scheduled: %s", row["id"], e, retry_error)
+                continue
+            if dropped:
+                logger.error("Webhook %s dropped after %s attempts: %s", row["id"], row["attempts"], e)
+            else:
+                logger.warning("Webhook %s failed (attempt %s), will retry: %s", row["id"], row["attempts"], e)
+    event_id_var.set(None)
+
+    try:
+        update_payment_statuses(transitions)
+    except Exception as e:
+        logger.error("Status update for %s transitions failed, deferred: %s", len(transitions), e)
+        for payment_id, status in transitions:
+            record_payment_status(payment_id, status)
+    complete_webhooks(done)
+    return len(done)
+
+
+def _worker(vkbots: Dict[int, Any]) -> None:
+    while True:
+        try:
+            # Отсчёт аренды — до запроса, чтобы не переоценить оставшееся время
+            lease_deadline = time.monotonic() + WEBHOOK_LEASE_SECONDS
+            rows = claim_webhooks(WEBHOOK_BATCH_SIZE, WEBHOOK_LEASE_SECONDS)
+            if rows:
+                process_batch(rows, vkbots, lease_deadline)
+                continue
+        except Exception as e:
+            logger.error("Webhook worker error: %s", e)
+        # Очередь пуста (или БД недоступна) — ждём нового уведомления в этом процессе
+        # или следующего опроса (уведомление мог принять другой процесс)
+        _wakeup.wait(WEBHOOK_POLL_SECONDS)
+        _wakeup.clear()
+
+
+def start_webhook_workers(vkbots: Dict[int, Any]) -> None:
+    """
+    Запускает WEBHOOK_WORKERS потоков-обработчиков в текущем процессе.
+    После fork потоки нужно запустить заново — проверяем pid.
+    """
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        for number in range(WEBHOOK_WORKERS):
+            threading.Thread(target=_worker, args=(vkbots,), name=f"webhook-{number}", daemon=True).start()
+        _workers_pid = os.getpid()
@@ -1,47 +1,144 @@
+import time
 import uuid
-from typing import Dict, Any
+import requests
+from typing import Dict, Any, Callable, Optional
 from yookassa import Configuration, Payment
-from config import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, BASE_URL
-from utils.db import set_payment, mark_paid
-import json
-from pathlib import Path
+from yookassa.client import ApiClient
+from yookassa.domain.common import HttpVerb, UserAgent
+from yookassa.domain.request import PaymentRequest
+from yookassa.domain.response import PaymentResponse
+from yookassa.domain.exceptions import (
+    BadRequestError, ForbiddenError, NotFoundError, UnauthorizedError, ResponseProcessingError,
+)
+from config import BASE_URL
+from config import YOOKASSA_TIMEOUT_MIN, YOOKASSA_TIMEOUT_MAX
+from utils.circuit_breaker import get_breaker
+from utils.profiling import span
+from utils.storage import get_storage
+from utils.retention import record_payment_status
+from utils.messages import get_messages
+from utils.tenants import DEFAULT_TENANT_ID, get_tenant_by_id
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Загружаем сообщения
-try:
-    MESSAGES = json.load(open(Path(__file__).parent.parent / "static" / "messages.json", encoding="utf-8"))
-except Exception as e:
-    logger.error(f"Error loading messages: {e}")
-    MESSAGES = {}
+# Одна HTTP-сессия (пул keep-alive соединений) на процесс для всех магазинов.
+# Без повторов: сессия SDK повторяет POST до max_attempts раз с паузами, и
+# таймаут предохранителя перестаёт ограничивать длительность вызова
+session = requests.Session()
 
-# Настройка официального SDK
-Configuration.account_id = YOOKASSA_SHOP_ID
-Configuration.secret_key = YOOKASSA_SECRET_KEY
+# Ошибки в самом запросе (4xx) не говорят о проблемах YooKassa и не размыкают цепь.
+# 202 (ResponseProcessingError) — запрос принят и ещё обрабатывается, это тоже не отказ
+breaker = get_breaker(
+    "yookassa",
+    min_timeout=YOOKASSA_TIMEOUT_MIN,
+    max_timeout=YOOKASSA_TIMEOUT_MAX,
+    ignore_exceptions=(BadRequestError, ForbiddenError, NotFoundError, UnauthorizedError,
+                       ResponseProcessingError),
+)
 
+# Повторы запроса с тем же Idempotence-Key после ответа 202 (как в SDK: max_attempts = 3)
+PROCESSING_RETRIES = 3
+# Пауза, если YooKassa не прислала retry_after (в SDK — Configuration.timeout, 1.8 с)
+DEFAULT_RETRY_AFTER = 1.8
 
-def create_payment_for_user(user_vk_id: int, amount: float) -> Dict[str, Any]:
+
+class TimeoutApiClient(ApiClient):
+    """
+    ApiClient из SDK с таймаутом HTTP-запроса и учётными данными конкретного магазина.
+    Сам SDK таймаут в requests не передаёт, и запрос может висеть бесконечно,
+    а учётные данные берёт из глобальной Configuration — одной на процесс.
+    """
+
+    def __init__(self, shop_id: str, secret_key: str, timeout: Optional[float] = None):
+        # ApiClient.__init__ не вызываем: он требует глобальные учётные данные
+        self.configuration = Configuration
+        self.endpoint = Configuration.api_endpoint()
+        self.shop_id = shop_id
+        self.shop_password = secret_key
+        self.auth_token = None
+        self.timeout = Configuration.timeout
+        self.max_attempts = Configuration.max_attempts
+        self.user_agent = UserAgent()
+        self.request_timeout = timeout
+
+    def get_session(self):
+        return session
+
+    def execute(self, body, method, path, query_params, request_headers):
+        # Сессия общая — не закрываем её после запроса
+        return self.get_session().request(
+            method,
+            self.endpoint + path,
+            params=query_params,
+            headers=request_headers,
+            json=body,
+            verify=self.configuration.verify,
+            timeout=self.request_timeout
+        )
+
+
+def _retry_after(error: ResponseProcessingError) -> float:
+    """Пауза перед повтором из тела ответа 202 (retry_after — в миллисекундах)"""
+    body = error.args[0] if error.args else None
+    try:
+        return float(body["retry_after"]) / 1000
+    except (TypeError, KeyError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def _create_payment(params: Dict[str, Any], idempotence_key: str, tenant) -> PaymentResponse:
+    """
+    Аналог Payment.create с предохранителем и адаптивным таймаутом.
+    На ответ 202 («ещё обрабатывается») повторяет запрос с тем же Idempotence-Key
+    через retry_after, не больше PROCESSING_RETRIES раз и не дольше YOOKASSA_TIMEOUT_MAX
+    в сумме; паузы между попытками предохранитель не учитывает.
     """
-    Создаёт платёж в YooKassa и возвращает confirmation_url и payment.id.
+    if not tenant.yookassa_shop_id or not tenant.yookassa_secret_key:
+        raise ValueError(f"YooKassa credentials are not set for tenant {tenant.tenant_id}")
+    client = TimeoutApiClient(tenant.yookassa_shop_id, tenant.yookassa_secret_key)
+    request = PaymentRequest(params)
+    deadline = time.monotonic() + breaker.max_timeout
+    for attempt in range(PROCESSING_RETRIES + 1):
+        try:
+            with breaker.guard() as timeout, span("http.yookassa.payments.create"):
+                client.request_timeout = max(0.1, min(timeout, deadline - time.monotonic()))
+                response = client.request(HttpVerb.POST, Payment.base_path, None,
+                                          {"Idempotence-Key": idempotence_key}, request)
+            return PaymentResponse(response)
+        except ResponseProcessingError as e:
+            delay = _retry_after(e)
+            if attempt == PROCESSING_RETRIES or time.monotonic() + delay >= deadline:
+                raise
+            logger.info("YooKassa is still processing payment request, retry in %.1fs", delay)
+            time.sleep(delay)
+
+
+def create_payment_for_user(user_vk_id: int, amount: float, tenant_id: int = DEFAULT_TENANT_ID) -> Dict[str, Any]:
+    """
+    Создаёт платёж в магазине YooKassa сообщества и возвращает confirmation_url и payment.id.
     """
     try:
+        tenant = get_tenant_by_id(tenant_id)
+        if tenant is None:
+            raise ValueError(f"Unknown tenant {tenant_id}")
         idempotence_key = uuid.uuid4().hex
-        payment = Payment.create({
+        payment = _create_payment({
             "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
             "confirmation": {"type": "redirect", "return_url": f"{BASE_URL}/"},
             "capture": True,
             "description": f"Оплата материалов user {user_vk_id}",
-            "metadata": {"user_vk_id": str(user_vk_id)}
-        }, idempotence_key)
+            "metadata": {"user_vk_id": str(user_vk_id), "tenant_id": str(tenant_id)}
+        }, idempotence_key, tenant)
 
         payment_id = payment.id
         confirmation_url = payment.confirmation.confirmation_url
         
         # Сохраняем привязку в БД
-        set_payment(user_vk_id, payment_id, amount, "RUB")
+        get_storage().set_payment(user_vk_id, payment_id, amount, "RUB", tenant_id=tenant_id)
         
-        logger.info(f"Payment created: {payment_id}, amount: {amount}, user: {user_vk_id}")
+        logger.info("Payment created: %s, amount: %s, user: %s, tenant: %s", payment_id, amount, user_vk_id, tenant_id,
+                    extra={"event": "payment_created"})
         
         return {
             "payment_id": payment_id,
@@ -49,15 +146,22 @@ def create_payment_for_user(user_vk_id: int, amount: float) -> Dict[str, Any]:
         }
         
     except Exception as e:
-        logger.error(f"Error creating payment for user {user_vk_id}: {e}")
+        logger.error("Error creating payment for user %s: %s", user_vk_id, e)
         raise
 
 
-def process_webhook_event(payload: Dict[str, Any], vkbot) -> None:
+def process_webhook_event(payload: Dict[str, Any], vkbot,
+                          record_status: Callable[[str, str], None] = record_payment_status,
+                          replay: bool = False) -> None:
     """
     Обрабатывает JSON webhook от YooKassa.
     Ожидаем структуру: {'event': 'payment.succeeded', 'object': {...}}
+    vkbot — обёртка сообщества, которому принадлежит платёж (metadata.tenant_id).
     После успешной оплаты отправляет пользователю подтверждение и уникальную ссылку с токеном.
+    Переходы 'canceled'/'failed' передаются в record_status (payment_id, status).
+    replay — уведомление обрабатывается повторно: ссылка с уже выданным токеном
+    отправляется ещё раз, если прошлая попытка оборвалась до отправки.
+    Ошибка БД пробрасывается, чтобы уведомление было обработано повторно.
     """
     try:
         event = payload.get("event")
@@ -72,17 +176,17 @@ def process_webhook_event(payload: Dict[str, Any], vkbot) -> None:
         metadata = obj.get("metadata", {})
         user_vk = metadata.get("user_vk_id")
         
-        logger.info(f"Webhook event: {event}, status: {status}, payment: {payment_id}")
+        logger.info("Webhook event: %s, status: %s, payment: %s", event, status, payment_id)
         
         if status == "succeeded" and payment_id:
             # Обновляем БД — отмечаем, что оплата прошла и генерируем токен
-            token = mark_paid(payment_id)
+            token = get_storage().mark_paid(payment_id, replay=replay)
             
             # Отправляем пользователю сообщение с подтверждением
             if user_vk and token:
                 try:
                     # Сообщение подтверждения
-                    confirmation_msg = MESSAGES.get("payment_confirmed", "✅ Оплата подтверждена!")
+                    confirmation_msg = get_messages().get("payment_confirmed", "✅ Оплата подтверждена!")
                     vkbot.send_message(int(user_vk), confirmation_msg)
                     
                     # Генерируем уникальную ссылку с токеном
@@ -90,31 +194,36 @@ def process_webhook_event(payload: Dict[str, Any], vkbot) -> None:
                     # Оборачиваем в VK away.php для безопасности
                     vk_away_url = f"https://vk.com/away.php?to={access_url}"
                     
-                    access_msg = MESSAGES.get("access_ready", 
+                    access_msg = get_messages().get("access_ready", 
                         "✅ Доступ открыт!\n\n🔗 Ваша личная ссылка:\n{url}").format(url=vk_away_url)
                     vkbot.send_message(int(user_vk), access_msg)
                     
-                    logger.info(f"Access link sent to user {user_vk}")
+                    logger.info("Access link sent to user %s", user_vk)
                     
                 except Exception as exc:
-                    logger.error(f"Error sending VK message to {user_vk}: {exc}")
+                    logger.error("Error sending VK message to %s: %s", user_vk, exc)
         
         elif status == "canceled":
-            logger.info(f"Payment {payment_id} canceled")
+            logger.info("Payment %s canceled", payment_id)
+            if payment_id:
+                record_status(payment_id, "canceled")
             if user_vk:
                 try:
                     vkbot.send_message(int(user_vk), "⏸️ Платеж отменён")
                 except Exception as exc:
-                    logger.error(f"Error sending cancel message: {exc}")
+                    logger.error("Error sending cancel message: %s", exc)
         
         elif status == "failed":
-            logger.warning(f"Payment {payment_id} failed")
+            logger.warning("Payment %s failed", payment_id)
+            if payment_id:
+                record_status(payment_id, "failed")
             if user_vk:
                 try:
                     vkbot.send_message(int(user_vk), 
                         "❌ Платеж не прошёл. Попробуйте ещё раз, написав 'купить'")
                 except Exception as exc:
-                    logger.error(f"Error sending fail message: {exc}")
+                    logger.error("Error sending fail message: %s", exc)
                     
     except Exception as e:
-        logger.error(f"Error processing webhook event: {e}", exc_info=True)
+        logger.error("Error processing webhook event: %s", e, exc_info=True)
+        raise